@@ -0,0 +1,108 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from aiohttp import web, ClientSession
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src import api
+
+ACCOUNTS = 50
+PAGES = 3
+PAGE_SIZE = 20
+
+
+def create_app(connections: set) -> web.Application:
+    @web.middleware
+    async def count_connections(request: web.Request, handler):
+        connections.add(id(request.transport))
+        return await handler(request)
+
+    async def timeline(request: web.Request) -> web.Response:
+        page = int(request.query.get('lastId') or 0)
+        items = [
+            {'data': {'id': page * PAGE_SIZE + index, 'blocks': []}}
+            for index in range(PAGE_SIZE)
+        ]
+
+        return web.json_response({
+            'result': {
+                'items': items,
+                'lastId': page + 1 if page + 1 < PAGES else None,
+                'lastSortingValue': page + 1
+            }
+        })
+
+    async def subsite(request: web.Request) -> web.Response:
+        return web.json_response({
+            'result': {
+                'id': 1,
+                'url': f'https://vc.ru/{request.query["uri"]}',
+                'name': request.query['uri'],
+                'robotsTag': 'all'
+            }
+        })
+
+    app = web.Application(middlewares=[count_connections])
+    app.router.add_get('/v2.8/timeline', timeline)
+    app.router.add_get('/v2.7/subsite', subsite)
+    return app
+
+
+async def legacy_fetch_account(base_url: str, username: str):
+    async with ClientSession() as session:
+        async with session.get(f'{base_url}/v2.7/subsite', params={'uri': username}) as response:
+            await response.json()
+
+    params = {'markdown': 'false', 'sorting': 'new', 'uri': username}
+    async with ClientSession() as session:
+        while True:
+            await asyncio.sleep(1)
+            async with session.get(f'{base_url}/v2.8/timeline', params=params) as response:
+                result = (await response.json())['result']
+                params['lastId'] = result['lastId']
+                params['lastSortingValue'] = result['lastSortingValue']
+
+                if not params['lastId']:
+                    break
+
+
+async def pooled_fetch_account(username: str):
+    await api.fetch_user_data('vc.ru', username)
+    await api.fetch_user_posts('vc.ru', username)
+
+
+async def measure(name: str, connections: set, coroutines: list):
+    connections.clear()
+    started_at = time.perf_counter()
+    await asyncio.gather(*coroutines)
+
+    elapsed = time.perf_counter() - started_at
+    print(f'{name}: {len(connections)} connections for {ACCOUNTS} accounts, {elapsed:.2f}s')
+
+
+async def main():
+    connections = set()
+    runner = web.AppRunner(create_app(connections))
+    await runner.setup()
+
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+
+    port = site._server.sockets[0].getsockname()[1]
+    base_url = f'http://127.0.0.1:{port}'
+    api.OSNOVA_API_URL = base_url
+
+    try:
+        usernames = [f'user{index}' for index in range(ACCOUNTS)]
+        await measure('before', connections, [legacy_fetch_account(base_url, username) for username in usernames])
+        await measure('after', connections, [pooled_fetch_account(username) for username in usernames])
+    finally:
+        await api.close_sessions()
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src import storage
+from src.storage import Account, StorageData
+
+SIZES = [1_000, 10_000]
+UPDATES = 200
+
+
+def create_accounts(size: int) -> list[Account]:
+    return [
+        Account(id=index, url=f'https://vc.ru/user{index}', mode='оба', domain='vc.ru', username=f'user{index}')
+        for index in range(1, size + 1)
+    ]
+
+
+def legacy_update_account(path: str, account_id: int, **kwargs):
+    with open(path, 'r', encoding='utf-8') as file:
+        storage_data = StorageData.model_validate_json(file.read())
+
+    for account in storage_data.accounts:
+        if account.id == account_id:
+            account.__dict__.update(**kwargs)
+            break
+
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(storage_data.model_dump_json(indent=2))
+
+
+def measure(name: str, size: int, update):
+    started_at = time.perf_counter()
+    for index in range(UPDATES):
+        update(index % size + 1, last_post_id=index)
+
+    elapsed = time.perf_counter() - started_at
+    print(f'{name} ({size} accounts): {elapsed / UPDATES * 1000:.2f} ms per update_account')
+
+
+def main():
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, 'storage.json')
+            with open(json_path, 'w', encoding='utf-8') as file:
+                file.write(StorageData(accounts=create_accounts(size)).model_dump_json(indent=2))
+
+            measure('json', size, lambda account_id, **kwargs: legacy_update_account(json_path, account_id, **kwargs))
+
+            storage.ENGINE = None
+            storage.STORAGE = None
+            storage.STORAGE_PATH = json_path
+            storage.DATABASE_PATH = os.path.join(directory, 'storage.db')
+            storage.get_engine()
+
+            measure('sqlite', size, storage.update_account)
+            storage.get_engine().dispose()
+
+
+if __name__ == '__main__':
+    main()
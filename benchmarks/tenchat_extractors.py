@@ -0,0 +1,112 @@
+import asyncio
+import multiprocessing
+import resource
+import sys
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+from rewire import Space
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+ROUNDS = 20
+SYNTHETIC_PAGES = 20
+SCAN_CHUNK_SIZE = 16 * 1024
+
+
+def create_synthetic_page(index: int) -> bytes:
+    state = ','.join(f'{{"id":{item},"title":"Пост {item}","text":"{"Текст публикации " * 20}"}}' for item in range(400))
+    blocked = '<div data-cy="blocked" class="profile-blocked">Пользователь заблокирован</div>' if index % 2 else ''
+    return (
+        '<!doctype html><html><head><title>TenChat</title>'
+        f'<script>window.__NUXT__={{"posts":[{state}]}}</script></head><body>'
+        '<div class="layout">' + '<div class="menu"><a href="/feed">Лента</a></div>' * 200 +
+        f'<section class="profile"><h1 data-cy="name" class="profile-name"><span>Иван</span> Петров {index}</h1>{blocked}</section>'
+        + '<article class="post"><p>Публикация</p></article>' * 500 +
+        '</div></body></html>'
+    ).encode()
+
+
+def load_pages(paths: list[str]) -> list[bytes]:
+    if not paths:
+        return [create_synthetic_page(index) for index in range(SYNTHETIC_PAGES)]
+
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob('*.html')) if path.is_dir() else [path])
+    return [file.read_bytes() for file in files]
+
+
+def extract_with_beautifulsoup(page: bytes):
+    soup = BeautifulSoup(page.decode('utf-8', 'replace'), 'html.parser')
+    name_element = soup.find('h1', {'data-cy': 'name'})
+    name = name_element.get_text(separator=' ', strip=True) if name_element else ''
+    return name, soup.find('div', {'data-cy': 'blocked'}) is not None
+
+
+async def iter_page_chunks(page: bytes):
+    for offset in range(0, len(page), SCAN_CHUNK_SIZE):
+        yield page[offset:offset + SCAN_CHUNK_SIZE]
+
+
+async def extract_with_streaming(page: bytes) -> int:
+    from src import extractors
+
+    name_html, is_blocked, scanned, _ = await extractors.scan_tenchat_profile(iter_page_chunks(page))
+    if name_html is not None:
+        extractors.clean_text(name_html)
+    return len(scanned)
+
+
+async def measure_extractor(name: str, pages: list[bytes]) -> tuple[float, float, float]:
+    async with Space().init().use():
+        from src import extractors
+
+        extractor = extract_with_beautifulsoup if name == 'beautifulsoup' else extractors.EXTRACTORS.get(name)
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started_at = time.perf_counter()
+
+        scanned = 0
+        for _ in range(ROUNDS):
+            for page in pages:
+                if extractor:
+                    extractor(page)
+                    scanned += len(page)
+                else:
+                    scanned += await extract_with_streaming(page)
+
+        elapsed = time.perf_counter() - started_at
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return elapsed / (ROUNDS * len(pages)) * 1000, (rss_after - rss_before) / 1024, scanned / (ROUNDS * sum(map(len, pages)))
+
+
+async def get_extractor_names() -> list[str]:
+    async with Space().init().use():
+        from src import extractors
+        return ['beautifulsoup', *extractors.EXTRACTORS, 'streaming']
+
+
+def measure(name: str, paths: list[str], results: multiprocessing.Queue):
+    results.put(asyncio.run(measure_extractor(name, load_pages(paths))))
+
+
+def main():
+    paths = sys.argv[1:]
+    pages = load_pages(paths)
+    print(f'{len(pages)} pages, {sum(map(len, pages)) / len(pages) / 1024:.0f} KB on average')
+
+    context = multiprocessing.get_context('spawn')
+    for name in asyncio.run(get_extractor_names()):
+        results = context.Queue()
+        process = context.Process(target=measure, args=(name, paths, results))
+        process.start()
+
+        per_page, peak_memory, scanned = results.get()
+        process.join()
+        print(f'{name}: {per_page:.2f} ms per page, peak RSS +{peak_memory:.1f} MB, scanned {scanned:.0%} of page')
+
+
+if __name__ == '__main__':
+    main()
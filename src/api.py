@@ -1,174 +1,412 @@
 import asyncio
+import hashlib
 import time
-from typing import Optional, Dict, List, Union
+import zlib
+from collections import Counter
+from contextlib import suppress
+from typing import Optional, Dict, List, Union, Set, Tuple, AsyncIterator
 
-from aiohttp import ClientSession, BasicAuth
-from bs4 import BeautifulSoup
+from aiohttp import ClientSession, ClientResponse, TCPConnector, ClientTimeout, ClientConnectionError, ClientHttpProxyError
+from pydantic import BaseModel
+from rewire import config, simple_plugin
 
-from src import storage
+from src import storage, limits, extractors, proxies
 from src.storage import TenchatAuthData
 
-TENCHAT_BASE_URL = 'https://tenchat.ru/gostinder/api/web/post/user/username'
-TENCHAT_BASE_SIZE = 9
+plugin = simple_plugin()
+
+OSNOVA_API_URL = 'https://api.{domain}'
+OSNOVA_DOMAINS = ['vc.ru', 'dtf.ru']
+
+TENCHAT_URL = 'https://tenchat.ru'
+TENCHAT_BASE_URL = f'{TENCHAT_URL}/gostinder/api/web/post/user/username'
+
+TENCHAT_PROXY_ROUTE = 'tenchat.ru-proxy'
+TENCHAT_PROFILE_ROUTE = 'tenchat.ru-profiles'
+TENCHAT_PROFILE_ENCODING = 'gzip, deflate'
+
+TENCHAT_SCAN_CHUNK_SIZE = 16 * 1024
+
+SESSIONS: Dict[str, ClientSession] = {}
+TENCHAT_PROFILES: Dict[str, dict] = {}
+TENCHAT_AUTH_LOCK = asyncio.Lock()
+TENCHAT_AUTH_CHANGED = asyncio.Event()
+TENCHAT_TRAFFIC: Counter = Counter()
+
+
+@config
+class Config(BaseModel):
+    connection_limit: int = 100
+    connection_limit_per_host: int = 10
+    dns_cache_ttl: int = 300
+    keepalive_timeout: float = 60
+    total_timeout: float = 300
+    connect_timeout: float = 15
+    read_timeout: float = 60
+    account_timeout: float = 1800
+    tenchat_page_size: int = 50
+    page_attempts: int = 5
+    tenchat_token_margin: float = 300
+    tenchat_token_retry: float = 60
+
+
+def get_session(route: str) -> ClientSession:
+    session = SESSIONS.get(route)
+    if session is None or session.closed:
+        session = ClientSession(
+            auto_decompress=route != TENCHAT_PROFILE_ROUTE,
+            connector=TCPConnector(
+                limit=Config.connection_limit,
+                limit_per_host=Config.connection_limit_per_host,
+                ttl_dns_cache=Config.dns_cache_ttl,
+                keepalive_timeout=Config.keepalive_timeout
+            ),
+            timeout=ClientTimeout(
+                total=Config.total_timeout,
+                sock_connect=Config.connect_timeout,
+                sock_read=Config.read_timeout
+            )
+        )
+        SESSIONS[route] = session
+
+    return session
+
+
+async def close_sessions():
+    sessions = list(SESSIONS.values())
+    SESSIONS.clear()
+
+    for session in sessions:
+        await session.close()
+
+
+@plugin.setup()
+async def open_sessions():
+    for route in [*OSNOVA_DOMAINS, 'tenchat.ru', TENCHAT_PROXY_ROUTE, TENCHAT_PROFILE_ROUTE]:
+        get_session(route)
+
+
+@plugin.run()
+async def close_sessions_on_shutdown():
+    try:
+        await asyncio.Future()
+    finally:
+        await close_sessions()
 
-TENCHAT_PROXY = 'http://eu.lunaproxy.com:12233'
-TENCHAT_PROXY_AUTH = BasicAuth('user-reyingand_P0xoC-region-ru', '9QHJTXpnE07o')
 
+async def fetch_page(session: ClientSession, host: str, url: str, kind: str, **kwargs) -> Dict:
+    for attempt in range(1, Config.page_attempts + 1):
+        await limits.throttle(host)
+        started_at = time.monotonic()
 
-async def fetch_tenchat_default_username(username: str) -> Optional[str]:
+        try:
+            async with session.get(url, **kwargs) as response:
+                limits.record(host, response.status, time.monotonic() - started_at, response.headers.get('Retry-After'), kind)
+                if (response.status == 429 or response.status >= 500) and attempt < Config.page_attempts:
+                    continue
+
+                response.raise_for_status()
+                return await response.json()
+        except (ClientConnectionError, asyncio.TimeoutError):
+            if attempt == Config.page_attempts:
+                raise
+
+
+def on_storage_changed(key: str):
+    if key in ('tenchat_auth_data', 'storage'):
+        TENCHAT_AUTH_CHANGED.set()
+
+
+async def renew_tenchat_auth_data(valid_until: float) -> Optional[TenchatAuthData]:
+    async with TENCHAT_AUTH_LOCK:
+        auth_data = storage.get_tenchat_auth_data()
+        if not auth_data or auth_data.expires_at > valid_until:
+            return auth_data
+
+        new_auth_data = await refresh_tenchat_auth_data(auth_data.refresh_token)
+        if not new_auth_data:
+            return auth_data if auth_data.expires_at > time.time() else None
+
+        storage.set_tenchat_auth_data(new_auth_data)
+        return new_auth_data
+
+
+async def get_tenchat_access_token() -> Optional[str]:
     auth_data = storage.get_tenchat_auth_data()
-    if not auth_data:
-        return None
+    if auth_data and auth_data.expires_at <= time.time():
+        auth_data = await renew_tenchat_auth_data(time.time())
+
+    return auth_data.access_token if auth_data else None
+
 
-    if auth_data.expires_at <= time.time():
-        auth_data = await refresh_tenchat_auth_data(auth_data.refresh_token)
-        storage.set_tenchat_auth_data(auth_data)
+@plugin.run()
+async def keep_tenchat_auth_data_fresh():
+    storage.subscribe(on_storage_changed)
 
-    user_url = f'https://tenchat.ru/gostinder/api/web/auth/account/username/{username}'
+    while True:
+        TENCHAT_AUTH_CHANGED.clear()
+        auth_data = storage.get_tenchat_auth_data()
+
+        timeout = None
+        if auth_data:
+            renew_at = auth_data.expires_at - Config.tenchat_token_margin
+            if renew_at <= time.time():
+                auth_data = await renew_tenchat_auth_data(time.time() + Config.tenchat_token_margin)
+                renew_at = auth_data.expires_at - Config.tenchat_token_margin if auth_data else 0
+            timeout = max(renew_at - time.time(), Config.tenchat_token_retry)
+
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(TENCHAT_AUTH_CHANGED.wait(), timeout)
+
+
+async def fetch_tenchat_page(username: str, params: Dict) -> Dict:
+    for attempt in range(1, Config.page_attempts + 1):
+        try:
+            async with proxies.use(username) as endpoint:
+                await limits.throttle(endpoint.host)
+                started_at = time.monotonic()
+
+                async with get_session(TENCHAT_PROXY_ROUTE).get(
+                        f'{TENCHAT_BASE_URL}/{username}',
+                        params=params,
+                        proxy=endpoint.url,
+                        proxy_auth=endpoint.auth
+                ) as response:
+                    latency = time.monotonic() - started_at
+                    limits.record(endpoint.host, response.status, latency, response.headers.get('Retry-After'), 'posts')
+                    proxies.report(endpoint, response.status, latency)
+
+                    if (response.status in proxies.FAILURE_STATUSES or response.status >= 500) and attempt < Config.page_attempts:
+                        continue
+
+                    response.raise_for_status()
+                    return await response.json()
+        except (ClientConnectionError, ClientHttpProxyError, asyncio.TimeoutError):
+            if attempt == Config.page_attempts:
+                raise
+
+
+async def fetch_tenchat_default_username(username: str) -> Optional[str]:
+    access_token = await get_tenchat_access_token()
+    if not access_token:
+        return None
+
+    user_url = f'{TENCHAT_URL}/gostinder/api/web/auth/account/username/{username}'
     headers = {
-        'Authorization': f'Bearer {auth_data.access_token}'
+        'Authorization': f'Bearer {access_token}'
     }
 
     try:
-        async with ClientSession() as session:
-            async with session.get(user_url, headers=headers, timeout=10) as response:
-                response.raise_for_status()
-                response_data = await response.json()
-                return response_data.get('defaultUsername')
+        async with get_session('tenchat.ru').get(user_url, headers=headers, timeout=10) as response:
+            response.raise_for_status()
+            response_data = await response.json()
+            return response_data.get('defaultUsername')
     except Exception as e:
         print(f'Ошибка при получении defaultUsername: {e}')
         return None
 
 
 async def refresh_tenchat_auth_data(refresh_token: str) -> Optional[TenchatAuthData]:
-    auth_url = 'https://tenchat.ru/vbc-oauth2-gostinder/oauth/token'
+    auth_url = f'{TENCHAT_URL}/vbc-oauth2-gostinder/oauth/token'
     payload = {
         'refresh_token': refresh_token,
         'grant_type': 'refresh_token'
     }
 
     try:
-        async with ClientSession() as session:
-            async with session.post(auth_url, params=payload, timeout=10) as response:
-                response.raise_for_status()
-                response_data = await response.json()
-
-                return TenchatAuthData(
-                    access_token=response_data['access_token'],
-                    refresh_token=response_data['refresh_token'],
-                    expires_at=time.time() + response_data['expires_in']
-                )
+        async with get_session('tenchat.ru').post(auth_url, params=payload, timeout=10) as response:
+            response.raise_for_status()
+            response_data = await response.json()
+
+            return TenchatAuthData(
+                access_token=response_data['access_token'],
+                refresh_token=response_data['refresh_token'],
+                expires_at=time.time() + response_data['expires_in']
+            )
     except Exception as e:
         print(f'Ошибка при обновлении токена: {e}')
         return None
 
 
-async def fetch_user_data(domain: str, username: str) -> Optional[Dict]:
-    base_url = f'https://api.{domain}/v2.7/subsite'
+async def fetch_subsite(domain: str, username: str) -> Tuple[int, Optional[Dict]]:
+    base_url = f'{OSNOVA_API_URL.format(domain=domain)}/v2.7/subsite'
     params = {'markdown': 'False', 'uri': username}
 
-    async with ClientSession() as session:
-        async with session.get(base_url, params=params, timeout=None) as response:
-            if not response.ok:
-                return None
+    await limits.throttle(domain)
+    started_at = time.monotonic()
+
+    async with get_session(domain).get(base_url, params=params) as response:
+        limits.record(domain, response.status, time.monotonic() - started_at, response.headers.get('Retry-After'), 'subsite')
+        if not response.ok:
+            return response.status, None
+
+        result = await response.json()
+        user_data = result['result']
+
+        return response.status, {
+            'id': user_data['id'],
+            'url': user_data['url'],
+            'name': user_data['name'],
+            'is_blocked': user_data['robotsTag'] == 'noindex'
+        }
+
+
+async def fetch_user_data(domain: str, username: str) -> Optional[Dict]:
+    _, user_data = await fetch_subsite(domain, username)
+    return user_data
 
-            result = await response.json()
-            user_data = result['result']
 
-            return {
-                'id': user_data['id'],
-                'url': user_data['url'],
-                'name': user_data['name'],
-                'is_blocked': user_data['robotsTag'] == 'noindex'
-            }
+async def fetch_user_id(domain: str, username: str) -> Tuple[int, Optional[int]]:
+    status, user_data = await fetch_subsite(domain, username)
+    return status, user_data['id'] if user_data else None
 
 
 async def fetch_tenchat_user_data(username_or_id: Union[str, int]) -> Optional[Dict]:
-    async with ClientSession() as session:
-        async with session.get(
-                f'https://tenchat.ru/{username_or_id}',
-                timeout=None,
+    cached_profile = TENCHAT_PROFILES.get(str(username_or_id))
+    headers = {'Accept-Encoding': TENCHAT_PROFILE_ENCODING}
+
+    if cached_profile and cached_profile['etag']:
+        headers['If-None-Match'] = cached_profile['etag']
+    if cached_profile and cached_profile['last_modified']:
+        headers['If-Modified-Since'] = cached_profile['last_modified']
+
+    async with proxies.use(str(username_or_id)) as endpoint:
+        await limits.throttle(endpoint.host)
+        started_at = time.monotonic()
+
+        async with get_session(TENCHAT_PROFILE_ROUTE).get(
+                f'{TENCHAT_URL}/{username_or_id}',
                 allow_redirects=True,
-                proxy=TENCHAT_PROXY,
-                proxy_auth=TENCHAT_PROXY_AUTH
+                headers=headers,
+                proxy=endpoint.url,
+                proxy_auth=endpoint.auth
         ) as response:
-            if not response.ok:
-                return None
+            latency = time.monotonic() - started_at
+            limits.record(endpoint.host, response.status, latency, response.headers.get('Retry-After'), 'profile')
+            proxies.report(endpoint, response.status, latency)
+
+            return await read_tenchat_profile(username_or_id, cached_profile, response)
 
-            html = await response.text()
-            soup = BeautifulSoup(html, 'html.parser')
 
-            name_element = soup.find('h1', {'data-cy': 'name'})
-            name = name_element.get_text(separator=' ', strip=True) if name_element else ''
+async def iter_profile_chunks(response: ClientResponse, received: Counter) -> AsyncIterator[bytes]:
+    encoding = response.headers.get('Content-Encoding', '').lower()
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) if encoding in ('gzip', 'deflate') else None
 
-            blocked_element = soup.find('div', {'data-cy': 'blocked'})
-            is_blocked = blocked_element is not None
+    async for chunk in response.content.iter_chunked(TENCHAT_SCAN_CHUNK_SIZE):
+        received['bytes'] += len(chunk)
+        yield decompressor.decompress(chunk) if decompressor else chunk
 
-            return {
-                'url': str(response.url),
-                'name': name,
-                'is_blocked': is_blocked
-            }
+    if decompressor:
+        yield decompressor.flush()
 
 
-async def fetch_user_posts(domain: str, username: str, posts_amount: Optional[int] = None) -> List[Dict]:
-    base_url = f'https://api.{domain}/v2.8/timeline'
+async def read_tenchat_profile(username_or_id: Union[str, int], cached_profile: Optional[dict], response: ClientResponse) -> Optional[Dict]:
+    if response.status == 304 and cached_profile:
+        TENCHAT_TRAFFIC['not_modified'] += 1
+        TENCHAT_TRAFFIC['saved'] += cached_profile['size']
+        return dict(cached_profile['data'])
+
+    if not response.ok:
+        return None
+
+    received = Counter()
+    name_html, is_blocked, page, complete = await extractors.scan_tenchat_profile(iter_profile_chunks(response, received))
+    size = response.content_length or (received['bytes'] if complete else 0)
+
+    TENCHAT_TRAFFIC['received'] += received['bytes']
+    if not complete:
+        TENCHAT_TRAFFIC['saved'] += max(size - received['bytes'], 0)
+
+    name = None
+    if name_html is None:
+        name, is_blocked = await extractors.extract_tenchat_profile_async(page)
+        name_html = (name or '').encode()
+
+    digest = hashlib.sha256(name_html + (b'blocked' if is_blocked else b'')).hexdigest()
+    if cached_profile and cached_profile['digest'] == digest and cached_profile['data']['url'] == str(response.url):
+        TENCHAT_TRAFFIC['unchanged'] += 1
+        user_data = cached_profile['data']
+    else:
+        user_data = {
+            'url': str(response.url),
+            'name': name if name is not None else extractors.clean_text(name_html),
+            'is_blocked': is_blocked
+        }
+
+    TENCHAT_PROFILES[str(username_or_id)] = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'digest': digest,
+        'size': size,
+        'data': user_data
+    }
+
+    return dict(user_data)
+
+
+async def iter_user_posts(domain: str, username: str, posts_amount: Optional[int] = None, known_ids: Optional[Set[int]] = None) -> AsyncIterator[List[Dict]]:
+    base_url = f'{OSNOVA_API_URL.format(domain=domain)}/v2.8/timeline'
     params = {'markdown': 'false', 'sorting': 'new', 'uri': username}
 
-    posts = []
-    async with ClientSession() as session:
-        while True:
-            await asyncio.sleep(1)
-            async with session.get(base_url, params=params, timeout=None) as response:
-                response.raise_for_status()
-                result = await response.json()
+    posts_count = 0
+    session = get_session(domain)
+
+    while True:
+        result = (await fetch_page(session, domain, base_url, 'posts', params=params)).get('result', {})
+
+        items = result.get('items', [])
+        if not items:
+            break
 
-                items = result.get('result', {}).get('items', [])
-                if not items:
-                    break
+        posts = [item['data'] for item in items]
+        if posts_amount and posts_count + len(posts) >= posts_amount:
+            yield posts[:posts_amount - posts_count]
+            break
 
-                for item in items:
-                    posts.append(item['data'])
-                    if posts_amount and len(posts) >= posts_amount:
-                        return posts
+        posts_count += len(posts)
+        yield posts
 
-                params['lastId'] = result.get('result', {}).get('lastId')
-                params['lastSortingValue'] = result.get('result', {}).get('lastSortingValue')
+        if known_ids and any(post['id'] in known_ids for post in posts if not post.get('isPinned')):
+            break
 
-                if not params['lastId']:
-                    break
+        params['lastId'] = result.get('lastId')
+        params['lastSortingValue'] = result.get('lastSortingValue')
 
-    return posts
+        if not params['lastId']:
+            break
 
 
-async def fetch_tenchat_posts(username: str, posts_amount: Optional[int] = None) -> List[Dict]:
+async def fetch_user_posts(domain: str, username: str, posts_amount: Optional[int] = None, known_ids: Optional[Set[int]] = None) -> List[Dict]:
+    return [post async for posts in iter_user_posts(domain, username, posts_amount, known_ids) for post in posts]
+
+
+async def iter_tenchat_posts(username: str, posts_amount: Optional[int] = None, known_ids: Optional[Set[int]] = None) -> AsyncIterator[List[Dict]]:
     page = 0
-    posts = []
-
-    async with ClientSession() as session:
-        while True:
-            async with session.get(
-                    f'{TENCHAT_BASE_URL}/{username}?page={page}&size={TENCHAT_BASE_SIZE}',
-                    timeout=None,
-                    proxy=TENCHAT_PROXY,
-                    proxy_auth=TENCHAT_PROXY_AUTH
-            ) as response:
-                response.raise_for_status()
-                response_data = await response.json()
+    posts_count = 0
+    page_size = Config.tenchat_page_size
+
+    while True:
+        result = await fetch_tenchat_page(username, {'page': page, 'size': page_size})
+        posts = result.get('content', [])
+
+        if not posts:
+            break
+
+        if posts_amount and posts_count + len(posts) >= posts_amount:
+            yield posts[:posts_amount - posts_count]
+            break
+
+        posts_count += len(posts)
+        yield posts
 
-                content = response_data.get('content', [])
-                if not content:
-                    break
+        if result.get('last', len(posts) < page_size):
+            break
 
-                for item in content:
-                    posts.append(item)
-                    if posts_amount and len(posts) >= posts_amount:
-                        return posts
+        if known_ids and any(post['id'] in known_ids for post in posts):
+            break
 
-                if len(content) < TENCHAT_BASE_SIZE:
-                    break
+        page += 1
 
-                page += 1
-                await asyncio.sleep(1)
 
-    return posts
+async def fetch_tenchat_posts(username: str, posts_amount: Optional[int] = None, known_ids: Optional[Set[int]] = None) -> List[Dict]:
+    return [post async for posts in iter_tenchat_posts(username, posts_amount, known_ids) for post in posts]
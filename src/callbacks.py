@@ -17,7 +17,7 @@ class ParseAllCallback(CallbackData, prefix='parse_all'):
 
 
 class CancelParsingCallback(CallbackData, prefix='cancel_parsing'):
-    pass
+    message_id: int
 
 
 class MainMenuCallback(CallbackData, prefix='main_menu'):
@@ -31,6 +31,7 @@ class RegularParsingCallback(CallbackData, prefix='regular_parsing'):
 class ParseNowCallback(CallbackData, prefix='parse_now'):
     mode: Optional[str]
     blocked_mode: Optional[str] = None
+    full_resync: bool = False
 
 
 class AccountsCallback(CallbackData, prefix='accounts'):
@@ -0,0 +1,108 @@
+import asyncio
+import html
+import re
+from typing import Optional, Tuple, Callable, Dict, AsyncIterator
+
+from pydantic import BaseModel
+from rewire import config
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+TENCHAT_NAME_PATTERN = re.compile(rb'<h1\b[^>]*\bdata-cy=["\']?name(?=["\'\s>])[^>]*>(.*?)</h1>', re.S)
+TENCHAT_BLOCKED_PATTERN = re.compile(rb'<div\b[^>]*\bdata-cy=["\']?blocked(?=["\'\s>])')
+TAG_PATTERN = re.compile(rb'<[^>]+>')
+
+SCAN_OVERLAP = 256
+
+
+@config
+class Config(BaseModel):
+    tenchat_extractor: str = 'auto'
+    offload_size: int = 128 * 1024
+
+
+def clean_text(fragment: bytes) -> str:
+    text = TAG_PATTERN.sub(b' ', fragment).decode('utf-8', 'replace')
+    return ' '.join(html.unescape(text).split())
+
+
+def extract_with_selectolax(page: bytes) -> Tuple[Optional[str], bool]:
+    tree = HTMLParser(page)
+    name_node = tree.css_first('h1[data-cy="name"]')
+    name = ' '.join(name_node.text(separator=' ').split()) if name_node else None
+    return name, tree.css_first('div[data-cy="blocked"]') is not None
+
+
+def extract_with_lxml(page: bytes) -> Tuple[Optional[str], bool]:
+    tree = lxml.html.fromstring(page)
+    name_nodes = tree.xpath('//h1[@data-cy="name"]')
+    name = ' '.join(' '.join(name_nodes[0].itertext()).split()) if name_nodes else None
+    return name, bool(tree.xpath('//div[@data-cy="blocked"]'))
+
+
+def extract_with_regex(page: bytes) -> Tuple[Optional[str], bool]:
+    name_match = TENCHAT_NAME_PATTERN.search(page)
+    name = clean_text(name_match.group(1)) if name_match else None
+    return name, TENCHAT_BLOCKED_PATTERN.search(page) is not None
+
+
+EXTRACTORS: Dict[str, Callable[[bytes], Tuple[Optional[str], bool]]] = {
+    name: extractor for name, extractor, available in [
+        ('selectolax', extract_with_selectolax, HTMLParser is not None),
+        ('lxml', extract_with_lxml, lxml is not None),
+        ('regex', extract_with_regex, True)
+    ]
+    if available
+}
+
+
+def get_extractor(name: Optional[str] = None) -> Callable[[bytes], Tuple[Optional[str], bool]]:
+    name = name or Config.tenchat_extractor
+    if name in EXTRACTORS:
+        return EXTRACTORS[name]
+    return next(iter(EXTRACTORS.values()))
+
+
+def extract_tenchat_profile(page: bytes, extractor: Optional[str] = None) -> Tuple[Optional[str], bool]:
+    return get_extractor(extractor)(page)
+
+
+async def extract_tenchat_profile_async(page: bytes, extractor: Optional[str] = None) -> Tuple[Optional[str], bool]:
+    if len(page) >= Config.offload_size:
+        return await asyncio.to_thread(extract_tenchat_profile, page, extractor)
+    return extract_tenchat_profile(page, extractor)
+
+
+async def scan_tenchat_profile(chunks: AsyncIterator[bytes]) -> Tuple[Optional[bytes], bool, bytes, bool]:
+    buffer = b''
+    name_html = None
+    name_from = 0
+    is_blocked = False
+
+    async for chunk in chunks:
+        scan_from = max(len(buffer) - SCAN_OVERLAP, 0)
+        buffer += chunk
+
+        if name_html is None:
+            name_match = TENCHAT_NAME_PATTERN.search(buffer, name_from)
+            if name_match:
+                name_html = name_match.group(1)
+            else:
+                h1_start = buffer.rfind(b'<h1', name_from)
+                name_from = h1_start if h1_start >= 0 and buffer.find(b'</h1>', h1_start) < 0 else max(len(buffer) - SCAN_OVERLAP, 0)
+
+        if not is_blocked:
+            is_blocked = TENCHAT_BLOCKED_PATTERN.search(buffer, scan_from) is not None
+
+        if name_html is not None and is_blocked:
+            return name_html, is_blocked, buffer, False
+
+    return name_html, is_blocked, buffer, True
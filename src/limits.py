@@ -0,0 +1,230 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager, suppress
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+from rewire import config, logger
+
+TENCHAT_HOST = 'tenchat.ru'
+SHEETS_HOST = 'sheets'
+SHEETS_READ = 'sheets:read'
+SHEETS_WRITE = 'sheets:write'
+MEDIA_HOST = 'media'
+
+SEMAPHORES: Dict[str, asyncio.Semaphore] = {}
+RATE_LIMITERS: Dict[str, 'RateLimiter'] = {}
+TOKEN_BUCKETS: Dict[str, 'TokenBucket'] = {}
+LOCKS: Dict[str, asyncio.Lock] = {}
+
+
+@config
+class Config(BaseModel):
+    osnova_concurrency: int = 4
+    tenchat_concurrency: int = 2
+    sheets_concurrency: int = 1
+    media_concurrency: int = 8
+    osnova_rate: float = 4
+    tenchat_rate: float = 2
+    media_rate: float = 0
+    min_rate: float = 0.2
+    backoff_factor: float = 0.5
+    latency_factor: float = 2
+    latency_backoff_factor: float = 0.8
+    recovery_step: float = 0.1
+    baseline_decay: float = 0.005
+    slow_samples: int = 5
+    sheets_reads_per_minute: int = 60
+    sheets_writes_per_minute: int = 60
+
+
+class RateLimiter:
+    def __init__(self, host: str, rate: float):
+        self.host = host
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min(Config.min_rate, rate)
+        self.next_at = 0.0
+        self.latencies: Dict[str, float] = {}
+        self.base_latencies: Dict[str, float] = {}
+        self.slow_samples: Dict[str, int] = {}
+        self.backoffs = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if self.max_rate <= 0:
+            return
+
+        async with self.lock:
+            delay = self.next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self.next_at = time.monotonic() + 1 / self.rate
+
+    def record(self, status: int, latency: float, retry_after: Optional[float] = None, kind: str = 'default'):
+        if self.max_rate <= 0:
+            return
+
+        if status == 429 or status >= 500:
+            self.rate = max(self.min_rate, self.rate * Config.backoff_factor)
+            self.next_at = max(self.next_at, time.monotonic() + (retry_after or 1 / self.rate))
+            self.backoffs += 1
+            return logger.warning(f'Ответ {status} от {self.host}, снижаем частоту: {self.describe()}')
+
+        average = self.latencies.get(kind)
+        average = latency if average is None else average * 0.8 + latency * 0.2
+        self.latencies[kind] = average
+
+        baseline = self.base_latencies.get(kind, average)
+        baseline = average if average < baseline else baseline * (1 - Config.baseline_decay) + average * Config.baseline_decay
+        self.base_latencies[kind] = baseline
+
+        if average <= baseline * Config.latency_factor:
+            self.slow_samples[kind] = 0
+            self.rate = min(self.max_rate, self.rate + self.max_rate * Config.recovery_step)
+            return
+
+        self.slow_samples[kind] = self.slow_samples.get(kind, 0) + 1
+        if self.slow_samples[kind] >= Config.slow_samples:
+            self.slow_samples[kind] = 0
+            self.rate = max(self.min_rate, self.rate * Config.latency_backoff_factor)
+            logger.debug(f'Растёт задержка {self.host} ({kind}), снижаем частоту: {self.describe()}')
+
+    def describe(self) -> str:
+        latencies = ', '.join(
+            f'{kind} {latency * 1000:.0f} мс (база {self.base_latencies[kind] * 1000:.0f} мс)'
+            for kind, latency in self.latencies.items()
+        )
+        return f'{self.rate:.2f}/{self.max_rate:.2f} запросов/с, задержка: {latencies or "нет данных"}, снижений {self.backoffs}'
+
+
+class TokenBucket:
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.refill_rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.refill_rate)
+
+    def pause(self, seconds: float):
+        self.refill()
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def get_concurrency(host: str) -> int:
+    if host == TENCHAT_HOST:
+        return Config.tenchat_concurrency
+    if host == SHEETS_HOST:
+        return Config.sheets_concurrency
+    if host.startswith(MEDIA_HOST):
+        return Config.media_concurrency
+    return Config.osnova_concurrency
+
+
+def get_rate(host: str) -> float:
+    if host.startswith(TENCHAT_HOST):
+        return Config.tenchat_rate
+    if host.startswith(MEDIA_HOST):
+        return Config.media_rate
+    return Config.osnova_rate
+
+
+def get_capacity(name: str) -> int:
+    if name == SHEETS_WRITE:
+        return Config.sheets_writes_per_minute
+    return Config.sheets_reads_per_minute
+
+
+def get_media_host(host: str) -> str:
+    return f'{MEDIA_HOST}:{host}'
+
+
+def get_proxy_host(host: str, proxy: str) -> str:
+    return f'{host}@{proxy}'
+
+
+def get_semaphore(host: str) -> asyncio.Semaphore:
+    if host not in SEMAPHORES:
+        SEMAPHORES[host] = asyncio.Semaphore(max(get_concurrency(host), 1))
+    return SEMAPHORES[host]
+
+
+def get_rate_limiter(host: str) -> RateLimiter:
+    if host not in RATE_LIMITERS:
+        RATE_LIMITERS[host] = RateLimiter(host, get_rate(host))
+    return RATE_LIMITERS[host]
+
+
+def get_lock(name: str) -> asyncio.Lock:
+    if name not in LOCKS:
+        LOCKS[name] = asyncio.Lock()
+    return LOCKS[name]
+
+
+def get_token_bucket(name: str) -> TokenBucket:
+    if name not in TOKEN_BUCKETS:
+        TOKEN_BUCKETS[name] = TokenBucket(max(get_capacity(name), 1), 60)
+    return TOKEN_BUCKETS[name]
+
+
+@asynccontextmanager
+async def slot(host: str):
+    async with get_semaphore(host):
+        yield
+
+
+async def throttle(host: str):
+    await get_rate_limiter(host).wait()
+
+
+def get_retry_after(value: Optional[str]) -> Optional[float]:
+    with suppress(TypeError, ValueError):
+        return float(value)
+    return None
+
+
+def record(host: str, status: int, latency: float, retry_after: Optional[str] = None, kind: str = 'default'):
+    get_rate_limiter(host).record(status, latency, get_retry_after(retry_after), kind)
+
+
+def describe(host: str) -> str:
+    return get_rate_limiter(host).describe()
+
+
+def get_rate_states() -> Dict[str, dict]:
+    return {
+        host: {'rate': limiter.rate, 'max_rate': limiter.max_rate, 'latencies': dict(limiter.latencies), 'backoffs': limiter.backoffs}
+        for host, limiter in RATE_LIMITERS.items()
+        if limiter.max_rate > 0
+    }
+
+
+async def acquire(name: str):
+    await get_token_bucket(name).acquire()
+
+
+def pause(name: str, seconds: float):
+    get_token_bucket(name).pause(seconds)
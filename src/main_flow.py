@@ -1,9 +1,12 @@
 import asyncio
+import time
+from contextlib import suppress
 from datetime import datetime
 from datetime import timezone, timedelta
-from typing import Match
+from typing import Match, Optional, Dict, Tuple, List
 
 from aiogram import Dispatcher, Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, FSInputFile, CallbackQuery
@@ -21,6 +24,9 @@ plugin = simple_plugin()
 router = Router()
 
 PARSING_MODES = ['табл', 'серв', 'оба']
+PROGRESS_INTERVAL = 2
+
+PARSING_TASKS: Dict[Tuple[int, int], asyncio.Task] = {}
 
 
 @router.message(CommandStart())
@@ -130,38 +136,64 @@ async def parse_blocked_cancel_callback(callback: CallbackQuery, state: FSMConte
 
 
 @router.callback_query(CancelParsingCallback.filter())
-async def cancel_parsing_callback(callback: CallbackQuery, state: FSMContext):
-    await state.update_data(cancelled=True)
+async def cancel_parsing_callback(callback: CallbackQuery, callback_data: CancelParsingCallback):
+    parsing_task = PARSING_TASKS.pop((callback.message.chat.id, callback_data.message_id), None)
+    if not parsing_task or parsing_task.done():
+        return await callback.answer('Парсинг уже завершён.')
+
+    parsing_task.cancel()
+    await callback.message.edit_reply_markup()
     await callback.message.answer('🛑 Парсинг отменён.', reply_markup=menu_keyboard)
 
 
-async def load_server(message: Message, state: FSMContext, domain: str, username: str):
-    started_message = await message.answer(
-        f'⏳ Начат парсинг постов для пользователя {username}...',
+async def start_parsing_message(message: Message, username: str) -> Message:
+    started_message = await message.answer(f'⏳ Начат парсинг постов для пользователя {username}...')
+    await started_message.edit_reply_markup(
         reply_markup=InlineKeyboardBuilder()
-        .button(text='Остановить', callback_data=CancelParsingCallback())
+        .button(text='Остановить', callback_data=CancelParsingCallback(message_id=started_message.message_id))
         .as_markup()
     )
+    return started_message
+
+
+async def fetch_posts(started_message: Message, domain: str, username: str, amount: Optional[int]) -> Optional[list]:
+    posts_coroutine = api.fetch_tenchat_posts(username, amount) \
+        if domain == 'tenchat.ru' else \
+        api.fetch_user_posts(domain, username, amount)
+
+    task_key = (started_message.chat.id, started_message.message_id)
+    parsing_task = asyncio.create_task(asyncio.wait_for(posts_coroutine, api.Config.account_timeout))
+    PARSING_TASKS[task_key] = parsing_task
+
+    try:
+        await asyncio.wait([parsing_task])
+    finally:
+        parsing_task.cancel()
+        if PARSING_TASKS.get(task_key) is parsing_task:
+            PARSING_TASKS.pop(task_key)
+
+    return None if parsing_task.cancelled() else parsing_task.result()
+
+
+async def load_server(message: Message, state: FSMContext, domain: str, username: str):
+    started_message = await start_parsing_message(message, username)
 
     amount = await state.get_value('amount')
     await state.clear()
 
     try:
-        if domain == 'tenchat.ru':
-            user_posts = await api.fetch_tenchat_posts(username, amount)
-        else:
-            user_posts = await api.fetch_user_posts(domain, username, amount)
-    except ClientError:
+        user_posts = await fetch_posts(started_message, domain, username, amount)
+    except (ClientError, TimeoutError):
         await started_message.edit_text('⚠️ Ошибка при получении постов: пользователь не найден или произошёл сбой.')
         raise
 
-    if await state.get_value('cancelled'):
-        return await state.clear()
+    if user_posts is None:
+        return
 
     await started_message.edit_reply_markup()
     await message.answer(f'📥 Получены данные {len(user_posts)} постов для пользователя {username}. Сохраняю на сервер...')
 
-    user_posts_path = await utils.download_posts_files(domain, username, user_posts)
+    user_posts_path = await utils.download_posts_files(domain, username, utils.iterate_pages(user_posts))
     document_message = await message.answer_document(FSInputFile(user_posts_path))
     await document_message.reply(
         f'✅ Все данные пользователя {username} успешно сохранены.',
@@ -170,32 +202,24 @@ async def load_server(message: Message, state: FSMContext, domain: str, username
 
 
 async def load_sheets(message: Message, state: FSMContext, domain: str, username: str):
-    started_message = await message.answer(
-        f'⏳ Начат парсинг постов для пользователя {username}...',
-        reply_markup=InlineKeyboardBuilder()
-        .button(text='Остановить', callback_data=CancelParsingCallback())
-        .as_markup()
-    )
+    started_message = await start_parsing_message(message, username)
 
     amount = await state.get_value('amount')
     await state.clear()
 
     try:
-        if domain == 'tenchat.ru':
-            user_posts = await api.fetch_tenchat_posts(username, amount)
-        else:
-            user_posts = await api.fetch_user_posts(domain, username, amount)
-    except ClientError:
+        user_posts = await fetch_posts(started_message, domain, username, amount)
+    except (ClientError, TimeoutError):
         await started_message.edit_text('⚠️ Ошибка при получении постов: пользователь не найден или произошёл сбой.')
         raise
 
-    if await state.get_value('cancelled'):
-        return await state.clear()
+    if user_posts is None:
+        return
 
     await started_message.edit_reply_markup()
     await message.answer(f'📤 Получены данные {len(user_posts)} постов. Сохраняю в Google таблицу...')
 
-    await utils.unload_user_posts(domain, username, user_posts)
+    await utils.unload_user_posts(domain, username, utils.iterate_pages(user_posts))
     await message.answer(
         f'✅ Все данные пользователя {username} успешно сохранены в Google таблицу.',
         reply_markup=menu_keyboard
@@ -204,8 +228,8 @@ async def load_sheets(message: Message, state: FSMContext, domain: str, username
 
 @router.callback_query(RegularParsingCallback.filter())
 async def regular_parsing_callback(callback: CallbackQuery):
-    storage_data = storage.load_storage()
-    regular_parsing_status = '✅ Парсинг: работает' if storage_data.regular_parsing.enabled else '⏸️ Парсинг: пауза'
+    regular_parsing_settings = storage.get_regular_parsing_settings()
+    regular_parsing_status = '✅ Парсинг: работает' if regular_parsing_settings.enabled else '⏸️ Парсинг: пауза'
 
     await callback.message.edit_text(
         '⚙️ Настройки регулярного парсинга:',
@@ -477,6 +501,7 @@ async def parse_now_callback(callback: CallbackQuery, callback_data: ParseNowCal
             .button(text='По параметрам', callback_data=ParseNowCallback(mode=None))
             .button(text='В таблицу', callback_data=ParseNowCallback(mode='табл'))
             .button(text='На сервер', callback_data=ParseNowCallback(mode='серв'))
+            .button(text='Полная пересинхронизация', callback_data=ParseNowCallback(mode=None, full_resync=True))
             .button(text='Назад', callback_data=RegularParsingCallback())
             .button(text='Назад в меню', callback_data=MainMenuCallback())
             .adjust(1)
@@ -491,9 +516,9 @@ async def parse_now_callback(callback: CallbackQuery, callback_data: ParseNowCal
         return await callback.message.answer(
             '⚠️ Найдены заблокированные аккаунты. Какие парсим?',
             reply_markup=InlineKeyboardBuilder()
-            .button(text='Парсим все', callback_data=ParseNowCallback(mode=callback_data.mode, blocked_mode='all'))
-            .button(text='Только валидные', callback_data=ParseNowCallback(mode=callback_data.mode, blocked_mode='active'))
-            .button(text='Только заблоченные', callback_data=ParseNowCallback(mode=callback_data.mode, blocked_mode='blocked'))
+            .button(text='Парсим все', callback_data=ParseNowCallback(mode=callback_data.mode, blocked_mode='all', full_resync=callback_data.full_resync))
+            .button(text='Только валидные', callback_data=ParseNowCallback(mode=callback_data.mode, blocked_mode='active', full_resync=callback_data.full_resync))
+            .button(text='Только заблоченные', callback_data=ParseNowCallback(mode=callback_data.mode, blocked_mode='blocked', full_resync=callback_data.full_resync))
             .adjust(1)
             .as_markup()
         )
@@ -513,11 +538,12 @@ async def parse_now_callback(callback: CallbackQuery, callback_data: ParseNowCal
     accounts_by_id = {account.id: account for account in accounts}
     all_deleted_posts = []
     grouped_deleted_posts = {}
+    regular_parsing_data = []
 
     async def safe_parse(account):
         nonlocal success_count, failed_count
         try:
-            deleted_posts = await parse_account_posts(account, ignore_blocked=True)
+            deleted_posts = await parse_account_posts(account, ignore_blocked=True, full_resync=callback_data.full_resync, regular_parsing_data=regular_parsing_data)
             if deleted_posts:
                 all_deleted_posts.extend(deleted_posts)
                 grouped_deleted_posts[account.id] = deleted_posts
@@ -529,6 +555,11 @@ async def parse_now_callback(callback: CallbackQuery, callback_data: ParseNowCal
     tasks = [safe_parse(account) for account in selected_accounts]
     await asyncio.gather(*tasks)
 
+    try:
+        await sheets.update_regular_parsing_data(regular_parsing_data)
+    except Exception as e:
+        logger.error(f'Ошибка при выгрузке данных регулярного парсинга: {e}', exc_info=True)
+
     if grouped_deleted_posts:
         total_deleted = len(all_deleted_posts)
         logger.warning(f'Обнаружено {total_deleted} удалённых постов')
@@ -857,31 +888,47 @@ async def parse_ids_callback(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer('👤 Введи аккаунты для получения их ID:')
 
 
-@router.message(UserState.username_links, F.text)
-async def username_links_handler(message: Message, state: FSMContext):
-    status_message = await message.answer('⏳ Обработка...')
-    await state.clear()
+async def show_result_chunks(messages: List[Message], chunks: List[str], reply_markup=None):
+    for index, chunk in enumerate(chunks):
+        chunk_markup = reply_markup if index == len(chunks) - 1 else None
+        if index >= len(messages):
+            messages.append(await messages[0].answer(chunk, reply_markup=chunk_markup))
+        elif messages[index].text != chunk or chunk_markup:
+            with suppress(TelegramBadRequest):
+                messages[index] = await messages[index].edit_text(chunk, reply_markup=chunk_markup)
 
-    account_urls = message.text.splitlines()
-    result_lines = []
+    for extra_message in messages[len(chunks):]:
+        with suppress(TelegramBadRequest):
+            await extra_message.delete()
+    del messages[len(chunks):]
 
-    for account_url in account_urls:
-        parsed_args = await utils.parse_url(account_url)
-        if not parsed_args:
-            result_lines.append(f'{account_url} — ❌')
 
-        account_url, domain, username = parsed_args
-        if domain == 'tenchat.ru':
-            result_lines.append(account_url)
-        else:
-            user_data = await api.fetch_user_data(domain, username)
-            result_lines.append(f'https://{domain}/id{user_data['id']}')
+@router.message(UserState.username_links, F.text)
+async def username_links_handler(message: Message, state: FSMContext):
+    status_messages = [await message.answer('⏳ Обработка...')]
+    await state.clear()
 
-    result_text = '\n'.join(result_lines)
-    await status_message.delete()
-    await message.answer(
-        f'👌 Результат обработки {len(account_urls)} ссылок:'
-        f'\n\n{result_text}',
+    account_urls = list(dict.fromkeys(line.strip() for line in message.text.splitlines() if line.strip()))
+    results = {}
+    progress_at = time.monotonic()
+
+    async for account_url, result_line in utils.resolve_account_ids(account_urls):
+        results[account_url] = result_line
+        if time.monotonic() - progress_at >= PROGRESS_INTERVAL and len(results) < len(account_urls):
+            progress_at = time.monotonic()
+            await show_result_chunks(status_messages, utils.split_message([
+                f'⏳ Обработано {len(results)} из {len(account_urls)} ссылок:',
+                '',
+                *[results[account_url] for account_url in account_urls if account_url in results]
+            ]))
+
+    await show_result_chunks(
+        status_messages,
+        utils.split_message([
+            f'👌 Результат обработки {len(account_urls)} ссылок:',
+            '',
+            *[results[account_url] for account_url in account_urls]
+        ]),
         reply_markup=InlineKeyboardBuilder()
         .button(text='Назад в меню', callback_data=MainMenuCallback())
         .as_markup()
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import uuid
+from contextlib import suppress
+from typing import Optional, Dict, List, Tuple
+from urllib.parse import urlparse
+
+import aiofiles
+import aiofiles.os
+
+from src import api, limits, storage
+
+BLOBS_DIRECTORY = os.path.join('output', '.blobs')
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+DOWNLOADS: Dict[str, asyncio.Future] = {}
+
+
+def get_blob_path(digest: str, extension: str) -> str:
+    return os.path.join(BLOBS_DIRECTORY, digest[:2], f'{digest}.{extension}')
+
+
+async def link_blob(blob_path: str, file_path: str):
+    if await aiofiles.os.path.exists(file_path):
+        if os.path.samefile(blob_path, file_path):
+            return
+        await aiofiles.os.remove(file_path)
+
+    try:
+        await aiofiles.os.link(blob_path, file_path)
+    except OSError:
+        shutil.copyfile(blob_path, file_path)
+
+
+async def download_blob(url: str, default_extension: str) -> Optional[tuple[str, str, int, bool]]:
+    host = urlparse(url).netloc
+    media_host = limits.get_media_host(host)
+
+    await limits.throttle(media_host)
+    async with limits.slot(media_host), api.get_session(host).get(url) as response:
+        if not response.ok:
+            return None
+
+        content_type = response.headers.get('Content-Type')
+        extension = content_type.split('/')[-1] if content_type else default_extension
+
+        os.makedirs(BLOBS_DIRECTORY, exist_ok=True)
+        temp_path = os.path.join(BLOBS_DIRECTORY, f'{uuid.uuid4().hex}.tmp')
+        sha256 = hashlib.sha256()
+        size = 0
+
+        try:
+            async with aiofiles.open(temp_path, 'wb') as file:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    sha256.update(chunk)
+                    await file.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(temp_path)
+            raise
+
+    digest = sha256.hexdigest()
+    blob_path = get_blob_path(digest, extension)
+
+    deduplicated = await aiofiles.os.path.exists(blob_path)
+    if deduplicated:
+        await aiofiles.os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        await aiofiles.os.replace(temp_path, blob_path)
+
+    return digest, extension, size, deduplicated
+
+
+async def load_blobs(keys: List[str]) -> Dict[str, Tuple[str, str]]:
+    return await asyncio.to_thread(storage.get_media_blobs, keys) if keys else {}
+
+
+async def save_blobs(blobs: Dict[str, Tuple[str, str]]):
+    if blobs:
+        await asyncio.to_thread(storage.set_media_blobs, blobs)
+
+
+async def download_file(key: str, url: str, directory: str, name: str, default_extension: str, stats: dict, blobs: Dict[str, Tuple[str, str]], new_blobs: Dict[str, Tuple[str, str]]) -> Optional[str]:
+    blob = blobs.get(key)
+    if blob and await aiofiles.os.path.exists(get_blob_path(*blob)):
+        stats['cached'] += 1
+    else:
+        if key not in DOWNLOADS:
+            DOWNLOADS[key] = asyncio.ensure_future(download_blob(url, default_extension))
+            DOWNLOADS[key].add_done_callback(lambda _: DOWNLOADS.pop(key, None))
+
+        download = await asyncio.shield(DOWNLOADS[key])
+        if not download:
+            return None
+
+        digest, extension, size, deduplicated = download
+        stats['files'] += 1
+        stats['bytes'] += size
+        stats['deduplicated'] += deduplicated
+
+        blob = blobs[key] = new_blobs[key] = digest, extension
+
+    digest, extension = blob
+    file_path = os.path.join(directory, f'{name}.{extension}')
+    await link_blob(get_blob_path(digest, extension), file_path)
+    return file_path
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, AsyncIterator
+from urllib.parse import urlparse, unquote
+
+from aiohttp import BasicAuth, ClientConnectionError, ClientHttpProxyError
+from pydantic import BaseModel
+from rewire import config, logger
+
+from src import limits
+
+FAILURE_STATUSES = {403, 407, 429}
+DIRECT_NAME = 'direct'
+
+ENDPOINTS: Optional[List['ProxyEndpoint']] = None
+ASSIGNMENTS: Dict[str, 'ProxyEndpoint'] = {}
+
+
+@config
+class Config(BaseModel):
+    tenchat_proxies: List[str] = []
+    tenchat_direct: bool = False
+    failure_threshold: int = 3
+    cooldown: float = 30
+    max_cooldown: float = 600
+
+
+class ProxyEndpoint:
+    def __init__(self, index: int, proxy_url: Optional[str]):
+        parsed = urlparse(proxy_url or '')
+        self.name = (parsed.hostname if parsed.port is None else f'{parsed.hostname}:{parsed.port}') if proxy_url else DIRECT_NAME
+        self.host = limits.get_proxy_host(limits.TENCHAT_HOST, f'{index}-{self.name}')
+        self.url = parsed._replace(netloc=self.name).geturl() if proxy_url else None
+        self.auth = BasicAuth(unquote(parsed.username), unquote(parsed.password or '')) if parsed.username else None
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.failures = 0
+        self.opened = 0
+        self.open_until = 0.0
+        self.in_flight = 0
+
+    def is_open(self) -> bool:
+        return self.open_until > time.monotonic()
+
+    def score(self) -> float:
+        return (self.latency or 0.1) * (1 + self.in_flight) / max(1 - self.error_rate, 0.05)
+
+    def record_success(self, latency: float):
+        self.latency = latency if not self.latency else self.latency * 0.8 + latency * 0.2
+        self.error_rate *= 0.8
+        self.failures = 0
+        self.opened = 0
+
+    def record_failure(self, reason: str):
+        self.error_rate = self.error_rate * 0.8 + 0.2
+        self.failures += 1
+        if self.failures < Config.failure_threshold or self.is_open():
+            return
+
+        self.open_until = time.monotonic() + min(Config.cooldown * 2 ** self.opened, Config.max_cooldown)
+        self.opened += 1
+        self.failures = 0
+
+        for key in [key for key, endpoint in ASSIGNMENTS.items() if endpoint is self]:
+            ASSIGNMENTS.pop(key)
+
+        logger.warning(f'Прокси {self.name} отключён на {self.open_until - time.monotonic():.0f} с: {reason}')
+
+    def describe(self) -> str:
+        state = 'отключён' if self.is_open() else 'активен'
+        return f'{self.name}: {state}, задержка {self.latency * 1000:.0f} мс, ошибки {self.error_rate:.0%}, запросов {self.in_flight}'
+
+
+def get_proxy_urls() -> List[str]:
+    return Config.tenchat_proxies or [proxy_url for proxy_url in os.getenv('TENCHAT_PROXIES', '').split(',') if proxy_url.strip()]
+
+
+def get_endpoints() -> List[ProxyEndpoint]:
+    if ENDPOINTS is None:
+        set_endpoints(get_proxy_urls())
+    return ENDPOINTS
+
+
+def set_endpoints(proxy_urls: List[str]):
+    global ENDPOINTS
+    endpoints = [ProxyEndpoint(index, proxy_url.strip()) for index, proxy_url in enumerate(proxy_urls)]
+
+    if not endpoints:
+        if not Config.tenchat_direct:
+            raise RuntimeError('Прокси TenChat не настроены: укажите src.proxies.tenchat_proxies или TENCHAT_PROXIES, либо включите src.proxies.tenchat_direct')
+
+        logger.warning('Прокси TenChat не настроены, запросы идут напрямую (src.proxies.tenchat_direct)')
+        endpoints = [ProxyEndpoint(0, None)]
+
+    ENDPOINTS = endpoints
+    ASSIGNMENTS.clear()
+
+
+def choose(key: Optional[str] = None) -> ProxyEndpoint:
+    endpoint = ASSIGNMENTS.get(key)
+    if endpoint and not endpoint.is_open():
+        return endpoint
+
+    endpoints = get_endpoints()
+    available = [endpoint for endpoint in endpoints if not endpoint.is_open()]
+    endpoint = min(available, key=ProxyEndpoint.score) if available else min(endpoints, key=lambda endpoint: endpoint.open_until)
+
+    if key is not None:
+        ASSIGNMENTS[key] = endpoint
+    return endpoint
+
+
+def report(endpoint: ProxyEndpoint, status: int, latency: float):
+    if status in FAILURE_STATUSES or status >= 500:
+        endpoint.record_failure(f'ответ {status}')
+    else:
+        endpoint.record_success(latency)
+
+
+@asynccontextmanager
+async def use(key: Optional[str] = None) -> AsyncIterator[ProxyEndpoint]:
+    endpoint = choose(key)
+    endpoint.in_flight += 1
+
+    try:
+        yield endpoint
+    except (ClientConnectionError, ClientHttpProxyError, asyncio.TimeoutError) as e:
+        endpoint.record_failure(repr(e))
+        raise
+    finally:
+        endpoint.in_flight -= 1
+
+
+def describe() -> List[str]:
+    return [endpoint.describe() for endpoint in ENDPOINTS or []]
@@ -0,0 +1,77 @@
+import time
+from typing import Optional, Tuple
+
+from cachetools import TLRUCache
+from pydantic import BaseModel
+from rewire import config
+
+from src import storage
+from src.storage import Resolution
+
+
+@config
+class Config(BaseModel):
+    cache_size: int = 4096
+    ttl: float = 7 * 24 * 60 * 60
+    negative_ttl: float = 60 * 60
+
+
+RESOLUTIONS: Optional[TLRUCache] = None
+
+
+def get_cache() -> TLRUCache:
+    global RESOLUTIONS
+    if RESOLUTIONS is None:
+        RESOLUTIONS = TLRUCache(
+            maxsize=Config.cache_size,
+            ttu=lambda url, resolution, now: resolution.expires_at,
+            timer=time.time
+        )
+    return RESOLUTIONS
+
+
+def get_resolution(url: str) -> Optional[Resolution]:
+    cache = get_cache()
+    if url in cache:
+        return cache[url]
+
+    resolution = storage.get_resolution(url)
+    if not resolution or resolution.expires_at <= time.time():
+        return None
+
+    cache[url] = resolution
+    return resolution
+
+
+def set_resolution(url: str, resolution: Resolution):
+    get_cache()[url] = resolution
+    storage.set_resolution(url, resolution)
+
+
+def remember(url: str, account_url: str, domain: str, username: str, user_id: Optional[int] = None) -> Tuple[str, str, str]:
+    set_resolution(url, Resolution(
+        account_url=account_url,
+        domain=domain,
+        username=username,
+        user_id=user_id,
+        expires_at=time.time() + Config.ttl
+    ))
+    return account_url, domain, username
+
+
+def forget(url: str, domain: str, username: str):
+    set_resolution(url, Resolution(
+        domain=domain,
+        username=username,
+        found=False,
+        expires_at=time.time() + Config.negative_ttl
+    ))
+
+
+def invalidate(domain: str, username: str, *urls: str):
+    cache = get_cache()
+    for url, resolution in list(cache.items()):
+        if url in urls or (resolution.domain, resolution.username) == (domain, username):
+            cache.pop(url, None)
+
+    storage.delete_resolutions(set(urls), domain, username)
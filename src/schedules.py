@@ -1,439 +1,557 @@
 import asyncio
-from datetime import datetime
-from typing import Optional
+from contextlib import suppress
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Optional, Dict
 
 import pytz
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from rewire import simple_plugin, logger
 
-from src import storage, utils, api, sheets, bot
+from src import storage, utils, api, sheets, bot, limits, timeline, resolver, proxies
 from src.callbacks import RegularParsingCallback, MainMenuCallback, DeleteInvalidCallback
-from src.storage import Account, RegularParsingSettings, MonitorAccountsSettings, MonitorPostsSettings
+from src.storage import Account, MonitorAccountsSettings
 
 plugin = simple_plugin()
 
-SEMAPHORE = asyncio.Semaphore(1)
 MOSCOW_TIMEZONE = pytz.timezone('Europe/Moscow')
 
+SCHEDULER_RETRY_DELAY = 10
 
-async def parse_account_posts(account: Account, mode: Optional[str] = None, ignore_blocked: bool = False):
-    async with SEMAPHORE:
-        domain, username = account.domain, account.username
-        user_data = await api.fetch_tenchat_user_data(username) \
-            if domain == 'tenchat.ru' else \
-            await api.fetch_user_data(domain, username)
+RUNNING_JOBS: Dict[str, asyncio.Task] = {}
+SCHEDULER_WAKEUP = asyncio.Event()
+SCHEDULER_TASK: Optional[asyncio.Task] = None
 
-        if 'name' in user_data:
-            account.name = user_data['name']
-            storage.update_account(account.id, url=account.url, name=account.name)
 
-        if not ignore_blocked and user_data['is_blocked']:
-            logger.error(f'Аккаунт {username} заблокирован')
-            raise
+async def parse_account_posts(account: Account, mode: Optional[str] = None, ignore_blocked: bool = False, full_resync: bool = False, regular_parsing_data: Optional[list] = None):
+    domain, username = account.domain, account.username
+    monitor_deleted = account.mode == 'оба' and not account.is_blocked
+    mode = mode or account.mode
 
-        try:
-            logger.info(f'Получаем посты для {username}...')
-            if domain == 'tenchat.ru':
-                user_posts = await api.fetch_tenchat_posts(username)
-            else:
-                user_posts = await api.fetch_user_posts(domain, username)
-        except Exception as e:
-            logger.error(f'Ошибка при получении постов для {username}: {e}', exc_info=True)
-            raise
+    deadline = None
+    try:
+        async with limits.slot(domain):
+            deadline = asyncio.timeout(api.Config.account_timeout)
+            async with deadline:
+                user_data = await api.fetch_tenchat_user_data(username) \
+                    if domain == 'tenchat.ru' else \
+                    await api.fetch_user_data(domain, username)
 
-        logger.info(f'Получены {len(user_posts)} постов для {username}')
-        deleted_posts = []
+                if 'name' in user_data:
+                    account.name = user_data['name']
+                    storage.update_account(account.id, url=account.url, name=account.name)
 
-        if account.mode == 'оба' and not account.is_blocked:
-            try:
-                existing_posts = await utils.load_user_posts(domain, username)
-                monitor_posts_ids = await sheets.get_monitor_posts_ids()
+                if not ignore_blocked and user_data['is_blocked']:
+                    logger.error(f'Аккаунт {username} заблокирован')
+                    raise
 
-                parsed_ids = {post['id'] for post in user_posts}
-                deleted_posts = [
-                    {
-                        'account_url': account.url,
-                        'name': account.name or account.username,
-                        **post
-                    }
-                    for post in existing_posts if post['post_id'] not in parsed_ids and post['post_id'] not in monitor_posts_ids
-                ]
-            except Exception as e:
-                logger.error(f'Ошибка при мониторинге постов для {username}: {e}', exc_info=True)
+                consumers = {'known_posts': partial(utils.collect_known_posts, domain)}
+                if mode in ('серв', 'оба'):
+                    consumers['files'] = partial(utils.download_posts_files, domain, username, last_post_id=account.last_post_id)
 
-        try:
-            mode = mode or account.mode
-            if mode in ('серв', 'оба'):
-                await utils.download_posts_files(domain, username, user_posts, last_post_id=account.last_post_id)
+                if mode in ('табл', 'оба'):
+                    consumers['user_data'] = partial(utils.extract_tenchat_user_data, username) \
+                        if domain == 'tenchat.ru' else \
+                        partial(utils.extract_user_data, domain, username)
+                    consumers['user_posts'] = partial(utils.unload_user_posts, domain, username)
 
-                last_post_id = user_posts[0]['id']
-                storage.update_account(account.id, last_post_id=last_post_id)
+                try:
+                    logger.info(f'Получаем посты для {username}...')
+                    pages = timeline.iter_account_posts(domain, username, full_resync=full_resync or monitor_deleted)
+                    results = await utils.broadcast_pages(pages, consumers)
+                except Exception as e:
+                    logger.error(f'Ошибка при обработке постов для {username}: {e}', exc_info=True)
+                    raise
+    except TimeoutError:
+        if deadline is None or not deadline.expired():
+            raise
 
-                logger.info(f'Файлы {username} сохранены на сервер')
+        logger.error(f'Превышено время парсинга {username}: {api.Config.account_timeout:.0f} с')
+        raise TimeoutError(f'Превышено время парсинга ({api.Config.account_timeout:.0f} с)')
 
-            if mode in ('табл', 'оба'):
-                user_data = utils.extract_tenchat_user_data(username, user_posts) \
-                    if domain == 'tenchat.ru' else \
-                    utils.extract_user_data(domain, username, user_posts)
+    parsed_posts = results['known_posts']
+    logger.info(f'Получены {len(parsed_posts)} постов для {username}')
+    deleted_posts = []
 
-                await sheets.update_regular_parsing_data([user_data])
-                await utils.unload_user_posts(domain, username, user_posts)
+    if monitor_deleted:
+        try:
+            known_posts = await utils.load_known_posts(domain, username)
+            monitor_posts_ids = await sheets.get_monitor_posts_ids()
 
-                logger.info(f'Данные {username} выгружены в Google таблицу')
+            parsed_ids = {post.post_id for post in parsed_posts}
+            deleted_posts = [
+                {
+                    'account_url': account.url,
+                    'name': account.name or account.username,
+                    **post.model_dump()
+                }
+                for post in known_posts if post.post_id not in parsed_ids and post.post_id not in monitor_posts_ids
+            ]
         except Exception as e:
-            logger.error(f'Ошибка при обработке данных для {username}: {e}', exc_info=True)
-            raise
+            logger.error(f'Ошибка при мониторинге постов для {username}: {e}', exc_info=True)
+        else:
+            utils.save_known_posts(domain, username, parsed_posts)
+    else:
+        utils.save_known_posts(domain, username, parsed_posts)
+
+    try:
+        if 'files' in results:
+            if parsed_posts:
+                storage.update_account(account.id, last_post_id=parsed_posts[0].post_id)
+
+            logger.info(f'Файлы {username} сохранены на сервер')
+
+        if 'user_data' in results:
+            if regular_parsing_data is None:
+                await sheets.update_regular_parsing_data([results['user_data']])
+            else:
+                regular_parsing_data.append(results['user_data'])
+
+            logger.info(f'Данные {username} выгружены в Google таблицу')
+    except Exception as e:
+        logger.error(f'Ошибка при обработке данных для {username}: {e}', exc_info=True)
+        raise
 
-        return deleted_posts
+    return deleted_posts
 
 
-def should_regular_parsing_run(settings: RegularParsingSettings) -> bool:
+def get_regular_parsing_due() -> Optional[datetime]:
+    settings = storage.get_regular_parsing_settings()
     if not settings.enabled or not settings.periodicity:
-        return False
+        return None
 
-    now = datetime.now(MOSCOW_TIMEZONE)
+    due_date = datetime.now(MOSCOW_TIMEZONE).date()
     if settings.last_run:
-        last_run = settings.last_run.astimezone(MOSCOW_TIMEZONE)
-        days_passed = (now.date() - last_run.date()).days
+        due_date = settings.last_run.astimezone(MOSCOW_TIMEZONE).date() + timedelta(days=settings.periodicity.interval)
+
+    return MOSCOW_TIMEZONE.localize(datetime.combine(due_date, settings.periodicity.time))
 
-        if days_passed < settings.periodicity.interval:
-            return False
 
-    target_time = datetime.combine(now.date(), settings.periodicity.time)
-    target_time = MOSCOW_TIMEZONE.localize(target_time)
+def get_monitor_accounts_due() -> Optional[datetime]:
+    settings = storage.get_monitor_accounts_settings()
+    if not settings.enabled or not settings.periodicity:
+        return None
+
+    if not settings.last_run:
+        return datetime.now(MOSCOW_TIMEZONE)
 
-    return now >= target_time
+    return settings.last_run.astimezone(MOSCOW_TIMEZONE) + timedelta(minutes=settings.periodicity)
 
 
-def should_monitor_accounts_run(settings: MonitorAccountsSettings) -> bool:
+def get_monitor_posts_due() -> Optional[datetime]:
+    settings = storage.get_monitor_posts_settings()
     if not settings.enabled or not settings.periodicity:
-        return False
+        return None
 
     now = datetime.now(MOSCOW_TIMEZONE)
+    slots = sorted(
+        MOSCOW_TIMEZONE.localize(datetime.combine(now.date() + timedelta(days=offset), target_time))
+        for offset in (-1, 0, 1)
+        for target_time in settings.periodicity
+    )
+
     if settings.last_run:
         last_run = settings.last_run.astimezone(MOSCOW_TIMEZONE)
-        minutes_passed = (now - last_run).total_seconds() / 60
+        missed_slots = [slot for slot in slots if last_run < slot <= now]
+        if missed_slots:
+            return missed_slots[-1]
 
-        if minutes_passed <= settings.periodicity:
-            return False
+    return next(slot for slot in slots if slot > now)
 
-    return True
 
+async def run_regular_parsing():
+    try:
+        regular_parsing_settings = storage.get_regular_parsing_settings()
 
-def should_monitor_posts_run(settings: MonitorPostsSettings) -> bool:
-    if not settings.enabled or not settings.periodicity:
-        return False
+        accounts = storage.get_accounts()
+        blocked_accounts = [account for account in accounts if account.is_blocked]
+        active_accounts = [account for account in accounts if not account.is_blocked]
 
-    now = datetime.now(MOSCOW_TIMEZONE)
-    today = now.date()
+        logger.info(f'🚀 Начат плановый парсинг {len(active_accounts)} аккаунтов...')
 
-    for target_time in settings.periodicity:
-        target_datetime = MOSCOW_TIMEZONE.localize(datetime.combine(today, target_time))
-        time_difference = abs((target_datetime - now).total_seconds())
+        success_count = 0
+        failed_count = 0
+        failed_accounts = []
 
-        if time_difference <= 60:
-            return True
+        accounts_by_id = {account.id: account for account in accounts}
+        all_deleted_posts = []
+        grouped_deleted_posts = {}
+        regular_parsing_data = []
 
-    return False
+        async def safe_parse(account):
+            nonlocal success_count, failed_count
+            try:
+                deleted_posts = await parse_account_posts(account, regular_parsing_data=regular_parsing_data)
+                if deleted_posts:
+                    all_deleted_posts.extend(deleted_posts)
+                    grouped_deleted_posts[account.id] = deleted_posts
+                success_count += 1
+            except Exception:
+                failed_count += 1
+                failed_accounts.append(account)
 
+        tasks = [safe_parse(account) for account in active_accounts]
+        await asyncio.gather(*tasks)
 
-async def schedule_regular_parsing_runner():
-    while True:
         try:
-            regular_parsing_settings = storage.get_regular_parsing_settings()
-            if not regular_parsing_settings.enabled or not should_regular_parsing_run(regular_parsing_settings):
-                await asyncio.sleep(10)
+            await sheets.update_regular_parsing_data(regular_parsing_data)
+        except Exception as e:
+            logger.error(f'Ошибка при выгрузке данных регулярного парсинга: {e}', exc_info=True)
+
+        if grouped_deleted_posts:
+            total_deleted = len(all_deleted_posts)
+            logger.warning(f'Обнаружено {total_deleted} удалённых постов')
+
+            lines = [
+                '✅ Мониторинг Статей',
+                f'Проверенных аккаунтов: {len(active_accounts)}',
+                f'Заблоченных аккаунтов: {len(blocked_accounts)}',
+                f'❌ Удаленных URL: {total_deleted}'
+            ]
+
+            for account_id, posts in grouped_deleted_posts.items():
+                account = accounts_by_id[account_id]
+                lines.append(f'\n{account.url} - {len(posts)}:')
+                for post in posts:
+                    lines.append(f'{post["post_id"]}')
+                for post in posts:
+                    lines.append(f'{post["post_url"]}')
+
+            await bot.send_to_admins('\n'.join(lines))
+
+        result_lines = [
+            f'✅ Парсинг завершён.',
+            f'Всего аккаунтов: {len(storage.get_accounts())}',
+            f'Успешно: {success_count}',
+            f'Неуспешно: {failed_count}'
+        ]
+
+        inline_keyboard = InlineKeyboardBuilder() \
+            .button(text='Назад', callback_data=RegularParsingCallback()) \
+            .button(text='Назад в меню', callback_data=MainMenuCallback())
+
+        if failed_accounts:
+            result_lines.append('\n❗️Не удалось спарсить следующие аккаунты:')
+            for index, account in enumerate(failed_accounts, start=1):
+                result_lines.append(f'{account.url} ({account.name or account.username})')
+
+            inline_keyboard.button(text='❌ Удалить невалид', callback_data=DeleteInvalidCallback())
+            storage.add_last_failed_accounts(failed_accounts)
+
+        await sheets.update_monitor_posts_data(all_deleted_posts)
+        await bot.send_to_admins(
+            '\n'.join(result_lines),
+            reply_markup=inline_keyboard.adjust(2).as_markup()
+        )
+
+        logger.info(f'✅ Парсинг завершён. Успешно: {success_count}, Неуспешно: {failed_count}.')
+        log_rate_states()
+        logger.info(f'⏳ Следующий запуск через {regular_parsing_settings.periodicity.interval} дней.')
+    except Exception as e:
+        logger.exception(f'Ошибка в планировщике: {e}', exc_info=True)
+
+
+def log_rate_states():
+    for host in limits.get_rate_states():
+        logger.info(f'Частота запросов {host}: {limits.describe(host)}')
+
+    for proxy_state in proxies.describe():
+        logger.info(f'Прокси TenChat {proxy_state}')
+
+
+def get_monitored_domains(settings: MonitorAccountsSettings) -> set[str]:
+    return {
+        domain for domain, enabled in [
+            ('dtf.ru', settings.dtf_enabled),
+            ('vc.ru', settings.vc_enabled),
+            ('tenchat.ru', settings.tenchat_enabled)
+        ]
+        if enabled
+    }
+
+
+async def fetch_account_status(account: Account) -> Optional[dict]:
+    domain, username = account.domain, account.username
+    logger.debug(f'Проверка аккаунта {username} ({domain})')
+
+    try:
+        async with limits.slot(domain):
+            user_data = await api.fetch_tenchat_user_data(username) \
+                if domain == 'tenchat.ru' else \
+                await api.fetch_user_data(domain, username)
+
+        assert user_data
+        return user_data
+    except Exception as e:
+        logger.error(f'Ошибка при получении данных для {username}: {e}', exc_info=True)
+        return None
+
+
+async def run_monitor_accounts():
+    try:
+        monitored_domains = get_monitored_domains(storage.get_monitor_accounts_settings())
+        accounts = [account for account in storage.get_accounts() if account.domain in monitored_domains]
+        if not accounts:
+            return logger.info('Мониторинг аккаунтов: нет аккаунтов для проверки на включённых площадках')
+
+        logger.info(f'🔄 Запуск мониторинга {len(accounts)} аккаунтов...')
+        tenchat_traffic = api.TENCHAT_TRAFFIC.copy()
+        users_data = await asyncio.gather(*[fetch_account_status(account) for account in accounts])
+
+        tenchat_traffic = api.TENCHAT_TRAFFIC - tenchat_traffic
+        if 'tenchat.ru' in monitored_domains:
+            logger.info(
+                f'Трафик прокси TenChat: получено {tenchat_traffic["received"] / 1024:.1f} КБ, сэкономлено {tenchat_traffic["saved"] / 1024:.1f} КБ '
+                f'({tenchat_traffic["not_modified"]} ответов 304, {tenchat_traffic["unchanged"]} страниц без изменений)'
+            )
+
+        log_rate_states()
+
+        changed_accounts = []
+        blocked_accounts = []
+        url_changed_accounts = []
+        account_updates = {}
+
+        for account, user_data in zip(accounts, users_data):
+            if not user_data:
+                continue
+
+            username = account.username
+            url_changed = user_data['url'] != account.last_url
+            blocked_changed = user_data['is_blocked'] != account.is_blocked
+
+            if url_changed:
+                status = 'смена URL' if account.last_url else 'перв.монит'
+                logger.info(f'Обнаружено изменение URL для {username}: {account.last_url} -> {user_data['url']}')
+                if account.last_url:
+                    resolver.invalidate(account.domain, username, account.url, account.last_url, user_data['url'])
+                    url_changed_accounts.append({
+                        'user_url': account.url,
+                        'old_url': account.last_url,
+                        'new_url': user_data['url'],
+                    })
+
+                account.name = user_data['name']
+                account.last_url = user_data['url']
+                account_updates[account.id] = {'name': account.name, 'last_url': account.last_url}
+            elif blocked_changed:
+                status = 'заблокирован' if user_data['is_blocked'] else 'разблокирован'
+                logger.warning(f'Обнаружено изменение статуса блокировки для {username}: {status}')
+                if user_data['is_blocked']:
+                    blocked_accounts.append(account)
+
+                account.name = user_data['name']
+                account.is_blocked = user_data['is_blocked']
+                account_updates[account.id] = {'name': account.name, 'is_blocked': account.is_blocked}
+            else:
                 continue
 
-            accounts = storage.get_accounts()
-            blocked_accounts = [account for account in accounts if account.is_blocked]
-            active_accounts = [account for account in accounts if not account.is_blocked]
+            changed_accounts.append({
+                'url': account.url,
+                'name': account.name or account.username,
+                'status': status,
+                'current_url': account.last_url
+            })
 
-            logger.info(f'🚀 Начат плановый парсинг {len(active_accounts)} аккаунтов...')
-            storage.update_regular_parsing_last_run()
+        storage.update_accounts(account_updates)
 
-            success_count = 0
-            failed_count = 0
-            failed_accounts = []
+        if url_changed_accounts or blocked_accounts:
+            total_count = len(accounts)
+            logger.info(f'Обнаружены изменения: {total_count} аккаунтов')
 
-            accounts_by_id = {account.id: account for account in accounts}
-            all_deleted_posts = []
-            grouped_deleted_posts = {}
+            unchanged_count = total_count - len(changed_accounts)
+            url_changed_count = len(url_changed_accounts)
+            blocked_count = len(blocked_accounts)
 
-            async def safe_parse(account):
-                nonlocal success_count, failed_count
-                try:
-                    deleted_posts = await parse_account_posts(account)
-                    if deleted_posts:
-                        all_deleted_posts.extend(deleted_posts)
-                        grouped_deleted_posts[account.id] = deleted_posts
-                    success_count += 1
-                except Exception:
-                    failed_count += 1
-                    failed_accounts.append(account)
-
-            tasks = [safe_parse(account) for account in active_accounts]
-            await asyncio.gather(*tasks)
-
-            if grouped_deleted_posts:
-                total_deleted = len(all_deleted_posts)
-                logger.warning(f'Обнаружено {total_deleted} удалённых постов')
-
-                lines = [
-                    '✅ Мониторинг Статей',
-                    f'Проверенных аккаунтов: {len(active_accounts)}',
-                    f'Заблоченных аккаунтов: {len(blocked_accounts)}',
-                    f'❌ Удаленных URL: {total_deleted}'
-                ]
-
-                for account_id, posts in grouped_deleted_posts.items():
-                    account = accounts_by_id[account_id]
-                    lines.append(f'\n{account.url} - {len(posts)}:')
-                    for post in posts:
-                        lines.append(f'{post["post_id"]}')
-                    for post in posts:
-                        lines.append(f'{post["post_url"]}')
-
-                await bot.send_to_admins('\n'.join(lines))
-
-            result_lines = [
-                f'✅ Парсинг завершён.',
-                f'Всего аккаунтов: {len(storage.get_accounts())}',
-                f'Успешно: {success_count}',
-                f'Неуспешно: {failed_count}'
+            blocked_header = '❌ Заблочены: {}'.format(blocked_count) if blocked_count else '✅ Заблочены: 0'
+            url_header = '🔁 Смена URL: {}'.format(url_changed_count) if url_changed_count else '✅ Смена URL: 0'
+
+            message_lines = [
+                '✅ Мониторинг Аккаунтов',
+                f'Всего: {total_count}',
+                f'Без изменений: {unchanged_count}\n',
+                blocked_header,
+                url_header
             ]
 
-            inline_keyboard = InlineKeyboardBuilder() \
-                .button(text='Назад', callback_data=RegularParsingCallback()) \
-                .button(text='Назад в меню', callback_data=MainMenuCallback())
+            if blocked_accounts:
+                message_lines.append('\nЗаблочены:')
+                for account in blocked_accounts:
+                    message_lines.append(account.url)
 
-            if failed_accounts:
-                result_lines.append('\n❗️Не удалось спарсить следующие аккаунты:')
-                for index, account in enumerate(failed_accounts, start=1):
-                    result_lines.append(f'{account.url} ({account.name or account.username})')
+            if url_changed_accounts:
+                message_lines.append('\nСмена URL:')
+                for item in url_changed_accounts:
+                    message_lines.append(f'{item['user_url']} : {item['old_url']} > {item['new_url']}')
 
+            inline_keyboard = InlineKeyboardBuilder()
+            if blocked_accounts:
                 inline_keyboard.button(text='❌ Удалить невалид', callback_data=DeleteInvalidCallback())
-                storage.add_last_failed_accounts(failed_accounts)
 
-            await sheets.update_monitor_posts_data(all_deleted_posts)
             await bot.send_to_admins(
-                '\n'.join(result_lines),
-                reply_markup=inline_keyboard.adjust(2).as_markup()
+                '\n'.join(message_lines),
+                reply_markup=inline_keyboard.as_markup()
             )
 
-            logger.info(f'✅ Парсинг завершён. Успешно: {success_count}, Неуспешно: {failed_count}.')
-            logger.info(f'⏳ Следующий запуск через {regular_parsing_settings.periodicity.interval} дней.')
-        except Exception as e:
-            logger.exception(f'Ошибка в планировщике: {e}', exc_info=True)
-            await asyncio.sleep(1)
+        if blocked_accounts:
+            storage.add_last_failed_accounts(blocked_accounts)
 
+        if changed_accounts:
+            await sheets.update_monitor_accounts_data(changed_accounts)
 
-async def schedule_monitor_accounts_runner():
-    while True:
-        try:
-            monitor_accounts_settings = storage.get_monitor_accounts_settings()
-            if not should_monitor_accounts_run(monitor_accounts_settings):
-                await asyncio.sleep(10)
+    except Exception as e:
+        logger.exception(f'Ошибка в мониторинге аккаунтов: {e}', exc_info=True)
+
+
+async def run_monitor_posts():
+    try:
+        posts_settings = storage.get_monitor_posts_settings()
+
+        accounts = storage.get_accounts() \
+            if posts_settings.accounts_mode == 'все' else \
+            storage.get_accounts(mode=posts_settings.accounts_mode)
+
+        blocked_accounts = [account for account in accounts if account.is_blocked]
+        active_accounts = [account for account in accounts if not account.is_blocked]
+
+        logger.info(f'🔄 Запускаем мониторинг постов {len(active_accounts)} аккаунтов...')
+
+        monitor_posts_ids = await sheets.get_monitor_posts_ids()
+        accounts_by_id = {account.id: account for account in accounts}
+        all_deleted_posts = []
+        grouped_deleted_posts = {}
+
+        for account in active_accounts:
+            try:
+                logger.debug(f'Проверка постов для {account.username}')
+                async with asyncio.timeout(api.Config.account_timeout):
+                    pages = timeline.iter_account_posts(account.domain, account.username, full_resync=True)
+                    parsed_posts = await utils.collect_known_posts(account.domain, pages)
+
+                known_posts = await utils.load_known_posts(account.domain, account.username)
+            except Exception as e:
+                logger.error(f'Ошибка при получении постов для {account.username}: {e}', exc_info=True)
                 continue
 
-            logger.info('🔄 Запуск мониторинга аккаунтов...')
-            accounts = [account for account in storage.get_accounts()]
-            storage.update_monitor_accounts_last_run()
+            parsed_ids = {post.post_id for post in parsed_posts}
 
-            changed_accounts = []
-            blocked_accounts = []
-            url_changed_accounts = []
+            deleted_posts = []
+            for old_post in known_posts:
+                if old_post.post_id not in parsed_ids and old_post.post_id not in monitor_posts_ids:
+                    logger.info(f'Обнаружен удалённый пост: {old_post.post_id} у {account.username}')
+                    deleted_posts.append({
+                        'account_url': account.url,
+                        'name': account.name or account.username,
+                        **old_post.model_dump()
+                    })
 
-            for account in accounts:
-                domain, username = account.domain, account.username
-                logger.debug(f'Проверка аккаунта {username} ({domain})')
+            utils.save_known_posts(account.domain, account.username, parsed_posts)
 
-                try:
-                    user_data = await api.fetch_tenchat_user_data(username) \
-                        if domain == 'tenchat.ru' else \
-                        await api.fetch_user_data(domain, username)
+            if deleted_posts:
+                all_deleted_posts.extend(deleted_posts)
+                grouped_deleted_posts[account.id] = deleted_posts
 
-                    assert user_data
-                except Exception as e:
-                    logger.error(f'Ошибка при получении данных для {account.username}: {e}', exc_info=True)
-                    continue
-
-                url_changed = user_data['url'] != account.last_url
-                blocked_changed = user_data['is_blocked'] != account.is_blocked
-
-                if url_changed:
-                    status = 'смена URL' if account.last_url else 'перв.монит'
-                    logger.info(f'Обнаружено изменение URL для {username}: {account.last_url} -> {user_data['url']}')
-                    if account.last_url:
-                        url_changed_accounts.append({
-                            'user_url': account.url,
-                            'old_url': account.last_url,
-                            'new_url': user_data['url'],
-                        })
+        if grouped_deleted_posts:
+            total_deleted = len(all_deleted_posts)
+            logger.warning(f'Обнаружено {total_deleted} удалённых постов')
 
-                    account.name = user_data['name']
-                    account.last_url = user_data['url']
-                    storage.update_account(account.id, name=account.name, last_url=account.last_url)
-                elif blocked_changed:
-                    status = 'заблокирован' if user_data['is_blocked'] else 'разблокирован'
-                    logger.warning(f'Обнаружено изменение статуса блокировки для {username}: {status}')
-                    if user_data['is_blocked']:
-                        blocked_accounts.append(account)
+            lines = [
+                '✅ Мониторинг Статей',
+                f'Проверенных аккаунтов: {len(active_accounts)}',
+                f'Заблоченных аккаунтов: {len(blocked_accounts)}',
+                f'❌ Удаленных URL: {total_deleted}'
+            ]
 
-                    account.name = user_data['name']
-                    account.is_blocked = user_data['is_blocked']
-                    storage.update_account(account.id, name=account.name, is_blocked=account.is_blocked)
-                else:
-                    continue
+            for account_id, posts in grouped_deleted_posts.items():
+                account = accounts_by_id[account_id]
+                lines.append(f'\n{account.url} - {len(posts)}:')
+                for post in posts:
+                    lines.append(f'{post["post_id"]}')
+                for post in posts:
+                    lines.append(f'{post["post_url"]}')
+
+            await bot.send_to_admins('\n'.join(lines))
+        else:
+            logger.info('Удалённых постов не обнаружено')
+            await bot.send_to_admins(
+                '\n✅ Мониторинг Статей'
+                f'\nПроверенных аккаунтов: {len(active_accounts)}'
+                f'\nЗаблоченных аккаунтов: {len(blocked_accounts)}'
+                '\n✅ Удаленных URL: 0'
+                '\n\nВсе ОК!'
+            )
 
-                changed_accounts.append({
-                    'url': account.url,
-                    'name': account.name or account.username,
-                    'status': status,
-                    'current_url': account.last_url
-                })
-
-            if url_changed_accounts or blocked_accounts:
-                total_count = len(accounts)
-                logger.info(f'Обнаружены изменения: {total_count} аккаунтов')
-
-                unchanged_count = total_count - len(changed_accounts)
-                url_changed_count = len(url_changed_accounts)
-                blocked_count = len(blocked_accounts)
-
-                blocked_header = '❌ Заблочены: {}'.format(blocked_count) if blocked_count else '✅ Заблочены: 0'
-                url_header = '🔁 Смена URL: {}'.format(url_changed_count) if url_changed_count else '✅ Смена URL: 0'
-
-                message_lines = [
-                    '✅ Мониторинг Аккаунтов',
-                    f'Всего: {total_count}',
-                    f'Без изменений: {unchanged_count}\n',
-                    blocked_header,
-                    url_header
-                ]
-
-                if blocked_accounts:
-                    message_lines.append('\nЗаблочены:')
-                    for account in blocked_accounts:
-                        message_lines.append(account.url)
-
-                if url_changed_accounts:
-                    message_lines.append('\nСмена URL:')
-                    for item in url_changed_accounts:
-                        message_lines.append(f'{item['user_url']} : {item['old_url']} > {item['new_url']}')
-
-                inline_keyboard = InlineKeyboardBuilder()
-                if blocked_accounts:
-                    inline_keyboard.button(text='❌ Удалить невалид', callback_data=DeleteInvalidCallback())
-
-                await bot.send_to_admins(
-                    '\n'.join(message_lines),
-                    reply_markup=inline_keyboard.as_markup()
-                )
+        await sheets.update_monitor_posts_data(all_deleted_posts)
+    except Exception as error:
+        logger.exception(f'Ошибка в мониторинге постов: {error}', exc_info=True)
 
-            if blocked_accounts:
-                storage.add_last_failed_accounts(blocked_accounts)
 
-            if changed_accounts:
-                await sheets.update_monitor_accounts_data(changed_accounts)
+SCHEDULE_JOBS = {
+    'regular_parsing': (get_regular_parsing_due, storage.update_regular_parsing_last_run, run_regular_parsing),
+    'monitor_accounts': (get_monitor_accounts_due, storage.update_monitor_accounts_last_run, run_monitor_accounts),
+    'monitor_posts': (get_monitor_posts_due, storage.update_monitor_posts_last_run, run_monitor_posts)
+}
 
-        except Exception as e:
-            logger.exception(f'Ошибка в мониторинге аккаунтов: {e}', exc_info=True)
 
-        await asyncio.sleep(10)
+def wake_scheduler(*_):
+    SCHEDULER_WAKEUP.set()
 
 
-async def schedule_monitor_posts_runner():
-    while True:
-        try:
-            posts_settings = storage.get_monitor_posts_settings()
-            if not should_monitor_posts_run(posts_settings):
-                await asyncio.sleep(10)
-                continue
+def start_job(name: str, mark_run, run):
+    def finish_job(_):
+        RUNNING_JOBS.pop(name, None)
+        wake_scheduler()
 
-            accounts = [
-                account for account in storage.get_accounts()
-                if posts_settings.accounts_mode == 'все' or posts_settings.accounts_mode == account.mode
-            ]
+    mark_run()
+    RUNNING_JOBS[name] = asyncio.create_task(run())
+    RUNNING_JOBS[name].add_done_callback(finish_job)
 
-            blocked_accounts = [account for account in accounts if account.is_blocked]
-            active_accounts = [account for account in accounts if not account.is_blocked]
 
-            logger.info(f'🔄 Запускаем мониторинг постов {len(active_accounts)} аккаунтов...')
-            storage.update_monitor_posts_last_run()
+def start_due_jobs() -> Optional[float]:
+    now = datetime.now(MOSCOW_TIMEZONE)
+    next_due = None
 
-            monitor_posts_ids = await sheets.get_monitor_posts_ids()
-            accounts_by_id = {account.id: account for account in accounts}
-            all_deleted_posts = []
-            grouped_deleted_posts = {}
+    for name, (get_due, mark_run, run) in SCHEDULE_JOBS.items():
+        if name in RUNNING_JOBS:
+            continue
 
-            for account in active_accounts:
-                try:
-                    logger.debug(f'Проверка постов для {account.username}')
-                    if account.domain == 'tenchat.ru':
-                        posts = await api.fetch_tenchat_posts(account.username)
-                    else:
-                        posts = await api.fetch_user_posts(account.domain, account.username)
-                except Exception as e:
-                    logger.error(f'Ошибка при получении постов для {account.username}: {e}', exc_info=True)
-                    continue
-
-                parsed_ids = {post['id'] for post in posts}
-                existing_posts = await utils.load_user_posts(account.domain, account.username)
-
-                deleted_posts = []
-                for old_post in existing_posts:
-                    if old_post['post_id'] not in parsed_ids and old_post['post_id'] not in monitor_posts_ids:
-                        logger.info(f'Обнаружен удалённый пост: {old_post['post_id']} у {account.username}')
-                        deleted_posts.append({
-                            'account_url': account.url,
-                            'name': account.name or account.username,
-                            **old_post
-                        })
+        due = get_due()
+        if due is None:
+            continue
 
-                if deleted_posts:
-                    all_deleted_posts.extend(deleted_posts)
-                    grouped_deleted_posts[account.id] = deleted_posts
+        if due <= now:
+            logger.debug(f'Запуск задачи {name} (запланирована на {due:%d.%m.%y %H:%M:%S})')
+            start_job(name, mark_run, run)
+        elif not next_due or due < next_due:
+            next_due = due
 
-            if grouped_deleted_posts:
-                total_deleted = len(all_deleted_posts)
-                logger.warning(f'Обнаружено {total_deleted} удалённых постов')
-
-                lines = [
-                    '✅ Мониторинг Статей',
-                    f'Проверенных аккаунтов: {len(active_accounts)}',
-                    f'Заблоченных аккаунтов: {len(blocked_accounts)}',
-                    f'❌ Удаленных URL: {total_deleted}'
-                ]
-
-                for account_id, posts in grouped_deleted_posts.items():
-                    account = accounts_by_id[account_id]
-                    lines.append(f'\n{account.url} - {len(posts)}:')
-                    for post in posts:
-                        lines.append(f'{post["post_id"]}')
-                    for post in posts:
-                        lines.append(f'{post["post_url"]}')
-
-                await bot.send_to_admins('\n'.join(lines))
-            else:
-                logger.info('Удалённых постов не обнаружено')
-                await bot.send_to_admins(
-                    '\n✅ Мониторинг Статей'
-                    f'\nПроверенных аккаунтов: {len(active_accounts)}'
-                    f'\nЗаблоченных аккаунтов: {len(blocked_accounts)}'
-                    '\n✅ Удаленных URL: 0'
-                    '\n\nВсе ОК!'
-                )
+    if next_due:
+        logger.debug(f'Следующая задача по расписанию в {next_due:%d.%m.%y %H:%M:%S}')
+
+    return (next_due - now).total_seconds() if next_due else None
+
+
+async def run_scheduler():
+    while True:
+        SCHEDULER_WAKEUP.clear()
+        try:
+            timeout = start_due_jobs()
+        except Exception as e:
+            logger.exception(f'Ошибка в планировщике: {e}', exc_info=True)
+            timeout = SCHEDULER_RETRY_DELAY
+
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(SCHEDULER_WAKEUP.wait(), timeout)
 
-            await sheets.update_monitor_posts_data(all_deleted_posts)
-        except Exception as error:
-            logger.exception(f'Ошибка в мониторинге постов: {error}', exc_info=True)
 
-        await asyncio.sleep(10)
+def log_scheduler_exit(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error(f'Планировщик остановлен: {task.exception()!r}')
 
 
 @plugin.run()
 async def start_schedules():
-    asyncio.create_task(schedule_regular_parsing_runner())
-    asyncio.create_task(schedule_monitor_accounts_runner())
-    asyncio.create_task(schedule_monitor_posts_runner())
+    global SCHEDULER_TASK
+    storage.subscribe(wake_scheduler)
+    SCHEDULER_TASK = asyncio.create_task(run_scheduler())
+    SCHEDULER_TASK.add_done_callback(log_scheduler_exit)
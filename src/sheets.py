@@ -2,24 +2,32 @@ import asyncio
 import os
 import random
 import time
+from collections import Counter
 from contextlib import suppress
+from contextvars import ContextVar
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from functools import wraps
+from typing import Optional, Dict, Set
 
 import gspread
 import pytz
+import requests
 from dotenv import load_dotenv
-from gspread.exceptions import WorksheetNotFound
+from gspread.exceptions import APIError, WorksheetNotFound
 from gspread.utils import *
 from gspread_formatting import *
 from gspread_formatting import set_column_width, Color
 from oauth2client.service_account import ServiceAccountCredentials
+from rewire import logger
+
+from src import limits, storage
 
 scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
 creds = ServiceAccountCredentials.from_json_keyfile_name('google_credentials.json', scope)
 client = gspread.authorize(creds)
-
-
 MAIN_SHEET = os.getenv('MAIN_SHEET')
+MAIN_SHEET_KEY = os.getenv('MAIN_SHEET_KEY')
 REGULAR_PARSING_WORKSHEET = os.getenv('REGULAR_PARSING_WORKSHEET')
 MONITOR_ACCOUNTS_WORKSHEET = os.getenv('MONITOR_ACCOUNTS_WORKSHEET')
 MONITOR_POSTS_WORKSHEET = os.getenv('MONITOR_POSTS_WORKSHEET')
@@ -41,19 +49,227 @@ NUMBER_FORMAT = {
     }
 }
 
+DAYS_FORMAT = {
+    'numberFormat': {
+        'type': 'NUMBER',
+        'pattern': '0'
+    }
+}
+
+MONITOR_POSTS_HEADER = [
+    'Дата обнаруж', 'Аккаунт', 'ФИО', 'ID', 'URL',
+    'Название статьи', 'Просмотры', 'Добавлено', 'Дн публ'
+]
+
+GREEN_COLOR = {'red': 0.345, 'green': 0.737, 'blue': 0.549}
+YELLOW_COLOR = {'red': 1.0, 'green': 0.831, 'blue': 0.392}
+RED_COLOR = {'red': 0.910, 'green': 0.486, 'blue': 0.455}
+
+READ = limits.SHEETS_READ
+WRITE = limits.SHEETS_WRITE
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+SPREADSHEET_TTL = 10 * 60
+SPREADSHEET_CACHE = {}
+SHEETS_METADATA: Dict[str, dict] = {}
+SPREADSHEET_LOCK = asyncio.Lock()
+MONITOR_POSTS_IDS: Optional[Set[int]] = None
+MONITOR_POSTS_LOCK = asyncio.Lock()
+MONITOR_POSTS_PREPARED = False
+
+API_CALLS: Counter = Counter()
+OPERATION: ContextVar[Optional[dict]] = ContextVar('operation', default=None)
+
 
 def from_serial_date(serial: float) -> datetime:
     return GOOGLE_SHEETS_EPOCH + timedelta(days=serial)
 
 
-def sync_get_user_data(title: str) -> list[dict]:
+def to_serial_date(value: datetime) -> float:
+    return (value - GOOGLE_SHEETS_EPOCH) / timedelta(days=1)
+
+
+def to_cell_data(value) -> dict:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {'userEnteredValue': {'numberValue': value}}
+
+    value = str(value)
+    if value.startswith('='):
+        return {'userEnteredValue': {'formulaValue': value}}
+
+    with suppress(ValueError):
+        return {'userEnteredValue': {'numberValue': to_serial_date(datetime.strptime(value, '%Y-%m-%d %H:%M:%S'))}}
+
+    return {'userEnteredValue': {'stringValue': value}}
+
+
+def format_request(sheet_id: int, a1_range: str, cell_format: dict) -> dict:
+    return {
+        'repeatCell': {
+            'range': a1_range_to_grid_range(a1_range, sheet_id),
+            'cell': {'userEnteredFormat': cell_format},
+            'fields': f'userEnteredFormat({",".join(cell_format.keys())})'
+        }
+    }
+
+
+def gradient_rule_request(sheet_id: int, a1_range: str, min_color: dict, mid_color: dict, max_color: dict) -> dict:
+    return {
+        'addConditionalFormatRule': {
+            'index': 0,
+            'rule': {
+                'ranges': [a1_range_to_grid_range(a1_range, sheet_id)],
+                'gradientRule': {
+                    'minpoint': {'type': 'MIN', 'color': min_color},
+                    'midpoint': {'type': 'PERCENTILE', 'value': '50', 'color': mid_color},
+                    'maxpoint': {'type': 'MAX', 'color': max_color}
+                }
+            }
+        }
+    }
+
+
+def column_width_request(sheet_id: int, column: str, width: int) -> dict:
+    column_index = a1_to_rowcol(f'{column}1')[1] - 1
+    return {
+        'updateDimensionProperties': {
+            'range': {
+                'sheetId': sheet_id,
+                'dimension': 'COLUMNS',
+                'startIndex': column_index,
+                'endIndex': column_index + 1
+            },
+            'properties': {'pixelSize': width},
+            'fields': 'pixelSize'
+        }
+    }
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    if not isinstance(error, APIError):
+        return None
+
+    retry_after = error.response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+
+    with suppress(ValueError):
+        return max(float(retry_after), 0)
+
+    with suppress(TypeError, ValueError):
+        return max((parsedate_to_datetime(retry_after) - datetime.now(pytz.utc)).total_seconds(), 0)
+
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, APIError):
+        return error.response.status_code in RETRYABLE_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def count_api_call():
+    current_operation = OPERATION.get()
+    if current_operation:
+        current_operation['calls'] += 1
+        API_CALLS[current_operation['name']] += 1
+
+
+async def run_with_retry(kind: str, func, *args, attempts=5, **kwargs):
+    for attempt in range(attempts):
+        await limits.acquire(kind)
+        count_api_call()
+
+        try:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+
+            if attempt == attempts - 1:
+                raise RuntimeError(f'❌ Превышено число попыток вызова {func.__name__}') from e
+
+            retry_after = get_retry_after(e)
+            wait = retry_after if retry_after is not None else 2 ** attempt + random.uniform(0, 1)
+
+            if isinstance(e, APIError) and e.response.status_code == 429:
+                limits.pause(kind, wait)
+
+            logger.warning(f'⏳ Google Sheets: {e}. Ждём {wait:.1f} сек...')
+            await asyncio.sleep(wait)
+
+
+def operation(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        current_operation = {'name': func.__name__, 'calls': 0}
+        token = OPERATION.set(current_operation)
+
+        try:
+            async with limits.slot(limits.SHEETS_HOST):
+                return await func(*args, **kwargs)
+        finally:
+            OPERATION.reset(token)
+            logger.debug(f'Google Sheets {func.__name__}: {current_operation["calls"]} вызовов API (всего {API_CALLS[func.__name__]})')
+
+    return wrapper
+
+
+async def get_spreadsheet() -> gspread.Spreadsheet:
+    global MAIN_SHEET_KEY
+    async with SPREADSHEET_LOCK:
+        spreadsheet = SPREADSHEET_CACHE.get('spreadsheet')
+        if spreadsheet and time.monotonic() - SPREADSHEET_CACHE['opened_at'] < SPREADSHEET_TTL:
+            return spreadsheet
+
+        spreadsheet = await run_with_retry(READ, client.open_by_key, MAIN_SHEET_KEY) \
+            if MAIN_SHEET_KEY else \
+            await run_with_retry(READ, client.open, MAIN_SHEET)
+
+        MAIN_SHEET_KEY = spreadsheet.id
+        SPREADSHEET_CACHE.update(spreadsheet=spreadsheet, opened_at=time.monotonic())
+        SHEETS_METADATA.clear()
+        return spreadsheet
+
+
+async def refresh_sheets_metadata(spreadsheet: gspread.Spreadsheet):
+    metadata = await run_with_retry(READ, spreadsheet.fetch_sheet_metadata, {
+        'includeGridData': 'false',
+        'fields': 'sheets(properties,conditionalFormats)'
+    })
+
+    SHEETS_METADATA.clear()
+    SHEETS_METADATA.update({sheet['properties']['title']: sheet for sheet in metadata['sheets']})
+
+
+async def get_sheet_metadata(title: str) -> Optional[dict]:
+    spreadsheet = await get_spreadsheet()
+    if title not in SHEETS_METADATA:
+        await refresh_sheets_metadata(spreadsheet)
+    return SHEETS_METADATA.get(title)
+
+
+def invalidate_sheet_metadata(title: str):
+    SHEETS_METADATA.pop(title, None)
+
+
+async def get_worksheet(title: str) -> gspread.Worksheet:
+    sheet = await get_sheet_metadata(title)
+    if not sheet:
+        raise WorksheetNotFound(title)
+
+    spreadsheet = await get_spreadsheet()
+    return gspread.Worksheet(spreadsheet, sheet['properties'], spreadsheet.id, spreadsheet.client)
+
+
+@operation
+async def get_user_data(title: str) -> list[dict]:
     try:
-        spreadsheet = run_with_retry(client.open, MAIN_SHEET)
-        worksheet = spreadsheet.worksheet(title)
+        worksheet = await get_worksheet(title)
     except WorksheetNotFound:
         return []
 
-    all_data = run_with_retry(worksheet.get_all_values, value_render_option='UNFORMATTED_VALUE')
+    all_data = await run_with_retry(READ, worksheet.get_all_values, value_render_option='UNFORMATTED_VALUE')
     if not all_data or len(all_data) < 2:
         return []
 
@@ -73,8 +289,8 @@ def sync_get_user_data(title: str) -> list[dict]:
 
         parsed_data.append({
             'post_id': int(row[id_index]),
-            'post_url': row[url_index],
-            'post_title': row[title_index],
+            'post_url': str(row[url_index]),
+            'post_title': str(row[title_index]),
             'views': int(row[views_index]),
             'publish_date': from_serial_date(row[date_index])
         })
@@ -82,26 +298,15 @@ def sync_get_user_data(title: str) -> list[dict]:
     return parsed_data
 
 
-async def get_user_data(title: str) -> list[dict]:
-    return await asyncio.to_thread(sync_get_user_data, title)
-
-
-def sync_update_user_data(title: str, users_data: list[dict]):
-    spreadsheet = run_with_retry(client.open, MAIN_SHEET)
-    worksheet = None
-
-    with suppress(WorksheetNotFound):
-        worksheet = spreadsheet.worksheet(title)
-        worksheet.clear()
-
-    if not worksheet:
-        worksheet = spreadsheet.add_worksheet(title=title, rows=100, cols=20)
-        worksheet.freeze(rows=1)
+@operation
+async def update_user_data(title: str, users_data: list[dict]):
+    spreadsheet = await get_spreadsheet()
+    sheet = await get_sheet_metadata(title)
 
     headers = list(users_data[0].keys()) + ['Дней с публикации', 'Просмотров/день', 'Ч и м', 'Мин']
-    run_with_retry(worksheet.update, [headers], 'A1')
+    last_row = len(users_data) + 1
 
-    values_to_insert = []
+    values_to_insert = [headers]
     for index, row in enumerate(users_data, start=2):
         values = list(row.values())
         values.extend([
@@ -112,12 +317,54 @@ def sync_update_user_data(title: str, users_data: list[dict]):
         ])
         values_to_insert.append(values)
 
-    run_with_retry(
-        worksheet.update,
-        values_to_insert,
-        f'A2:Z{len(users_data) + 1}',
-        value_input_option=ValueInputOption.user_entered
-    )
+    batch_requests = []
+    if sheet:
+        sheet_id = sheet['properties']['sheetId']
+        grid_properties = sheet['properties']['gridProperties']
+        rules_count = len(sheet.get('conditionalFormats', []))
+    else:
+        sheet_id = random.randrange(1, 2 ** 31)
+        grid_properties = {'rowCount': 100, 'columnCount': 20}
+        rules_count = 0
+
+        batch_requests.append({
+            'addSheet': {
+                'properties': {
+                    'sheetId': sheet_id,
+                    'title': title,
+                    'gridProperties': grid_properties
+                }
+            }
+        })
+
+    batch_requests.append({
+        'updateSheetProperties': {
+            'properties': {
+                'sheetId': sheet_id,
+                'gridProperties': {
+                    'rowCount': max(grid_properties['rowCount'], last_row),
+                    'columnCount': max(grid_properties['columnCount'], len(headers)),
+                    'frozenRowCount': 1
+                }
+            },
+            'fields': 'gridProperties(rowCount,columnCount,frozenRowCount)'
+        }
+    })
+
+    batch_requests.append({
+        'updateCells': {
+            'range': {'sheetId': sheet_id},
+            'fields': 'userEnteredValue'
+        }
+    })
+
+    batch_requests.append({
+        'updateCells': {
+            'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+            'rows': [{'values': [to_cell_data(value) for value in values]} for values in values_to_insert],
+            'fields': 'userEnteredValue'
+        }
+    })
 
     batch_formats = [{
         'range': 'A1:Z1',
@@ -125,27 +372,27 @@ def sync_update_user_data(title: str, users_data: list[dict]):
             'textFormat': {'bold': True}
         }
     }, {
-        'range': f'E2:E{len(users_data) + 1}',
+        'range': f'E2:E{last_row}',
         'format': {
             'numberFormat': {'type': 'DATE', 'pattern': 'd MMM'}
         }
     }, {
-        'range': f'G2:G{len(users_data) + 1}',
+        'range': f'G2:G{last_row}',
         'format': {
             'numberFormat': {'type': 'DATE', 'pattern': 'd MMM'}
         }
     }, {
-        'range': f'D2:D{len(users_data) + 1}',
+        'range': f'D2:D{last_row}',
         'format': {
             'numberFormat': {'type': 'NUMBER', 'pattern': '# ##0'}
         }
     }, {
-        'range': f'H2:H{len(users_data) + 1}',
+        'range': f'H2:H{last_row}',
         'format': {
             'numberFormat': {'type': 'NUMBER', 'pattern': '# ##0'}
         }
     }, {
-        'range': f'I2:I{len(users_data) + 1}',
+        'range': f'I2:I{last_row}',
         'format': {
             'numberFormat': {'type': 'NUMBER', 'pattern': '# ##0'}
         }
@@ -156,57 +403,48 @@ def sync_update_user_data(title: str, users_data: list[dict]):
         }
     }]
 
-    rules = run_with_retry(get_conditional_format_rules, worksheet)
-    rules.clear()
+    batch_requests.extend(format_request(sheet_id, batch_format['range'], batch_format['format']) for batch_format in batch_formats)
+    batch_requests.extend({'deleteConditionalFormatRule': {'sheetId': sheet_id, 'index': 0}} for _ in range(rules_count))
 
-    rules.append(ConditionalFormatRule(
-        ranges=[GridRange.from_a1_range(f'H2:H{len(users_data) + 1}', worksheet)],
-        gradientRule=GradientRule(
-            minpoint=InterpolationPoint(type='MIN', color=Color(0.345, 0.737, 0.549)),
-            midpoint=InterpolationPoint(type='PERCENTILE', value='50', color=Color(1.0, 0.831, 0.392)),
-            maxpoint=InterpolationPoint(type='MAX', color=Color(0.910, 0.486, 0.455))
-        )
-    ))
-
-    rules.append(ConditionalFormatRule(
-        ranges=[GridRange.from_a1_range(f'I2:I{len(users_data) + 1}', worksheet)],
-        gradientRule=GradientRule(
-            minpoint=InterpolationPoint(type='MIN', color=Color(0.910, 0.486, 0.455)),
-            midpoint=InterpolationPoint(type='PERCENTILE', value='50', color=Color(1.0, 0.831, 0.392)),
-            maxpoint=InterpolationPoint(type='MAX', color=Color(0.345, 0.737, 0.549))
-        )
-    ))
-
-    rules.append(ConditionalFormatRule(
-        ranges=[GridRange.from_a1_range(f'K2:K{len(users_data) + 1}', worksheet)],
-        gradientRule=GradientRule(
-            minpoint=InterpolationPoint(type='MIN', color=Color(0.345, 0.737, 0.549)),
-            midpoint=InterpolationPoint(type='PERCENTILE', value='50', color=Color(1.0, 0.831, 0.392)),
-            maxpoint=InterpolationPoint(type='MAX', color=Color(0.910, 0.486, 0.455))
-        )
-    ))
-
-    run_with_retry(rules.save)
-    run_with_retry(worksheet.batch_format, batch_formats)
-
-    max_length = max(len(str(val)) for val in run_with_retry(worksheet.col_values, 1))
-    run_with_retry(set_column_width, worksheet, 'A', max_length * 9)
-    run_with_retry(set_column_width, worksheet, 'B', 100)
-    run_with_retry(set_column_width, worksheet, 'C', 400)
-    run_with_retry(set_column_width, worksheet, 'J', 71)
-    run_with_retry(set_column_width, worksheet, 'K', 44)
+    batch_requests.extend([
+        gradient_rule_request(sheet_id, f'H2:H{last_row}', GREEN_COLOR, YELLOW_COLOR, RED_COLOR),
+        gradient_rule_request(sheet_id, f'I2:I{last_row}', RED_COLOR, YELLOW_COLOR, GREEN_COLOR),
+        gradient_rule_request(sheet_id, f'K2:K{last_row}', GREEN_COLOR, YELLOW_COLOR, RED_COLOR)
+    ])
 
+    max_length = max(len(str(values[0])) for values in values_to_insert)
+    widths = {'A': max_length * 9, 'B': 100, 'C': 400, 'J': 71, 'K': 44}
+    batch_requests.extend(column_width_request(sheet_id, column, width) for column, width in widths.items())
 
-async def update_user_data(title: str, users_data: list[dict]):
-    await asyncio.to_thread(sync_update_user_data, title, users_data)
+    try:
+        await run_with_retry(WRITE, spreadsheet.batch_update, {'requests': batch_requests})
+    except Exception:
+        invalidate_sheet_metadata(title)
+        raise
+
+    SHEETS_METADATA[title] = {
+        'properties': {
+            **(sheet['properties'] if sheet else {'sheetId': sheet_id, 'title': title}),
+            'gridProperties': {
+                'rowCount': max(grid_properties['rowCount'], last_row),
+                'columnCount': max(grid_properties['columnCount'], len(headers)),
+                'frozenRowCount': 1
+            }
+        },
+        'conditionalFormats': [request['addConditionalFormatRule']['rule'] for request in batch_requests if 'addConditionalFormatRule' in request]
+    }
 
 
-def sync_update_regular_parsing_data(users_data: list[dict]):
-    spreadsheet = client.open(MAIN_SHEET)
-    worksheet = spreadsheet.worksheet(REGULAR_PARSING_WORKSHEET)
+@operation
+async def update_regular_parsing_data(users_data: list[dict]):
+    if not users_data:
+        return
+
+    spreadsheet = await get_spreadsheet()
+    worksheet = await get_worksheet(REGULAR_PARSING_WORKSHEET)
+    sheet_id = worksheet.id
 
-    worksheet.freeze(rows=2)
-    existing_user_cells = run_with_retry(worksheet.row_values, 1)
+    existing_user_cells = await run_with_retry(READ, worksheet.row_values, 1)
     existing_users = {}
 
     for col in range(1, len(existing_user_cells) + 1, 8):
@@ -214,9 +452,24 @@ def sync_update_regular_parsing_data(users_data: list[dict]):
         if url:
             existing_users[url] = col
 
-    batch_updates = []
+    updated_users = {user['url']: existing_users[user['url']] for user in users_data if user['url'] in existing_users}
+    updated_columns = [rowcol_to_a1(1, user_col).replace('1', '') for user_col in updated_users.values()]
+
+    column_values = await run_with_retry(READ, worksheet.batch_get, [f'{col_letter}1:{col_letter}' for col_letter in updated_columns]) if updated_columns else []
+    next_rows = {user_col: max(len(values) + 1, 3) for user_col, values in zip(updated_users.values(), column_values)}
+
+    batch_requests = []
+    cell_updates = []
     batch_formats = []
 
+    if worksheet.frozen_row_count != 2:
+        batch_requests.append({
+            'updateSheetProperties': {
+                'properties': {'sheetId': sheet_id, 'gridProperties': {'frozenRowCount': 2}},
+                'fields': 'gridProperties.frozenRowCount'
+            }
+        })
+
     for user in users_data:
         url = user['url']
         name = user['name']
@@ -230,20 +483,13 @@ def sync_update_regular_parsing_data(users_data: list[dict]):
         else:
             user_col = max(existing_users.values()) + 8 if existing_users else 1
             existing_users[url] = user_col
+            next_rows[user_col] = 3
 
             col_letter = rowcol_to_a1(1, user_col).replace('1', '')
-            run_with_retry(worksheet.add_cols, 7)
-            batch_updates.append({
-                'range': f'{col_letter}1',
-                'values': [[url]]
-            })
-
-            batch_updates.append({
-                'range': f'{col_letter}2',
-                'values': [[
-                    name, 'Постов', 'Просмотр', 'рзн-Пст', 'рзн-Прс', 'сег-Пст', 'сег-Прс'
-                ]]
-            })
+            cell_updates.append((f'{col_letter}1', [url]))
+            cell_updates.append((f'{col_letter}2', [
+                name, 'Постов', 'Просмотр', 'рзн-Пст', 'рзн-Прс', 'сег-Пст', 'сег-Прс'
+            ]))
 
             batch_formats.append({
                 'range': f'{col_letter}2',
@@ -254,14 +500,13 @@ def sync_update_regular_parsing_data(users_data: list[dict]):
                 }
             })
 
-            widths = [57, 51, 68, 52, 55, 50, 53]
+            widths = [57, 51, 68, 52, 55, 50, 53, 10]
             for offset, width in enumerate(widths):
                 col_l = rowcol_to_a1(1, user_col + offset).replace('1', '')
-                run_with_retry(set_column_width, worksheet, col_l, width)
+                batch_requests.append(column_width_request(sheet_id, col_l, width))
 
             spacer_col = user_col + 7
             spacer_letter = rowcol_to_a1(1, spacer_col).replace('1', '')
-            run_with_retry(set_column_width, worksheet, spacer_letter, 10)
 
             batch_formats.append({
                 'range': f'{spacer_letter}1:{spacer_letter}',
@@ -280,9 +525,8 @@ def sync_update_regular_parsing_data(users_data: list[dict]):
                 }
             })
 
-        user_col_vals = run_with_retry(worksheet.col_values, user_col)
-        data_rows = user_col_vals[2:]
-        row_idx = len(data_rows) + 3
+        row_idx = next_rows[user_col]
+        next_rows[user_col] = row_idx + 1
         prev_row = row_idx - 1
         today = datetime.now(MOSCOW_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
 
@@ -300,41 +544,71 @@ def sync_update_regular_parsing_data(users_data: list[dict]):
             diff_posts, diff_views, today_posts, today_views
         ]
 
-        batch_updates.append({
-            'range': f'{rowcol_to_a1(row_idx, user_col)}',
-            'values': [user_row]
+        cell_updates.append((rowcol_to_a1(row_idx, user_col), user_row))
+
+    column_count = max(existing_users.values()) + 7
+    row_count = max(worksheet.row_count, max(next_rows.values()) - 1)
+
+    if column_count > worksheet.col_count or row_count > worksheet.row_count:
+        batch_requests.insert(0, {
+            'updateSheetProperties': {
+                'properties': {
+                    'sheetId': sheet_id,
+                    'gridProperties': {
+                        'rowCount': row_count,
+                        'columnCount': max(column_count, worksheet.col_count)
+                    }
+                },
+                'fields': 'gridProperties(rowCount,columnCount)'
+            }
         })
 
-    run_with_retry(worksheet.batch_update, batch_updates, value_input_option='USER_ENTERED')
-    last_row = worksheet.row_count
+    for a1_cell, values in cell_updates:
+        row, col = a1_to_rowcol(a1_cell)
+        batch_requests.append({
+            'updateCells': {
+                'start': {'sheetId': sheet_id, 'rowIndex': row - 1, 'columnIndex': col - 1},
+                'rows': [{'values': [to_cell_data(value) for value in values]}],
+                'fields': 'userEnteredValue'
+            }
+        })
 
-    for user_col in existing_users.values():
+    for url in {user['url'] for user in users_data}:
+        user_col = existing_users[url]
         date_col = rowcol_to_a1(1, user_col).replace('1', '')
         batch_formats.append({
-            'range': f'{date_col}3:{date_col}{last_row}',
+            'range': f'{date_col}3:{date_col}{row_count}',
             'format': DATE_FORMAT
         })
 
         for offset in [1, 2, 3, 4, 5, 6]:
             col_l = rowcol_to_a1(1, user_col + offset).replace('1', '')
             batch_formats.append({
-                'range': f'{col_l}3:{col_l}{last_row}',
+                'range': f'{col_l}3:{col_l}{row_count}',
                 'format': NUMBER_FORMAT
             })
 
-    run_with_retry(worksheet.batch_format, batch_formats)
-
+    batch_requests.extend(format_request(sheet_id, batch_format['range'], batch_format['format']) for batch_format in batch_formats)
 
-async def update_regular_parsing_data(users_data: list[dict]):
-    await asyncio.to_thread(sync_update_regular_parsing_data, users_data)
+    try:
+        await run_with_retry(WRITE, spreadsheet.batch_update, {'requests': batch_requests})
+    except Exception:
+        invalidate_sheet_metadata(REGULAR_PARSING_WORKSHEET)
+        raise
+
+    SHEETS_METADATA[REGULAR_PARSING_WORKSHEET]['properties']['gridProperties'].update(
+        rowCount=row_count,
+        columnCount=max(column_count, worksheet.col_count),
+        frozenRowCount=2
+    )
 
 
-def sync_update_monitor_accounts_data(users_data: list[dict]):
-    spreadsheet = client.open(MAIN_SHEET)
-    worksheet = spreadsheet.worksheet(MONITOR_ACCOUNTS_WORKSHEET)
+@operation
+async def update_monitor_accounts_data(users_data: list[dict]):
+    worksheet = await get_worksheet(MONITOR_ACCOUNTS_WORKSHEET)
 
-    worksheet.freeze(rows=2)
-    existing_user_cells = run_with_retry(worksheet.row_values, 1)
+    await run_with_retry(WRITE, worksheet.freeze, rows=2)
+    existing_user_cells = await run_with_retry(READ, worksheet.row_values, 1)
     existing_users = {}
 
     for col in range(1, len(existing_user_cells) + 1, 5):
@@ -358,7 +632,7 @@ def sync_update_monitor_accounts_data(users_data: list[dict]):
             existing_users[url] = user_col
 
             col_letter = rowcol_to_a1(1, user_col).replace('1', '')
-            run_with_retry(worksheet.add_cols, 3)
+            await run_with_retry(WRITE, worksheet.add_cols, 3)
             batch_updates.append({
                 'range': f'{col_letter}1',
                 'values': [[url]]
@@ -381,11 +655,11 @@ def sync_update_monitor_accounts_data(users_data: list[dict]):
             widths = [91, 77, 255, 39]
             for offset, width in enumerate(widths):
                 col_l = rowcol_to_a1(1, user_col + offset).replace('1', '')
-                run_with_retry(set_column_width, worksheet, col_l, width)
+                await run_with_retry(WRITE, set_column_width, worksheet, col_l, width)
 
             spacer_col = user_col + 4
             spacer_letter = rowcol_to_a1(1, spacer_col).replace('1', '')
-            run_with_retry(set_column_width, worksheet, spacer_letter, 10)
+            await run_with_retry(WRITE, set_column_width, worksheet, spacer_letter, 10)
 
             batch_formats.append({
                 'range': f'{spacer_letter}1:{spacer_letter}',
@@ -398,7 +672,7 @@ def sync_update_monitor_accounts_data(users_data: list[dict]):
                 }
             })
 
-        user_col_vals = run_with_retry(worksheet.col_values, user_col)
+        user_col_vals = await run_with_retry(READ, worksheet.col_values, user_col)
         data_rows = user_col_vals[2:]
         row_idx = len(data_rows) + 3
         prev_row = row_idx - 1
@@ -422,10 +696,10 @@ def sync_update_monitor_accounts_data(users_data: list[dict]):
             'values': [user_row]
         })
 
-    run_with_retry(worksheet.batch_update, batch_updates, value_input_option='USER_ENTERED')
+    await run_with_retry(WRITE, worksheet.batch_update, batch_updates, value_input_option='USER_ENTERED')
     last_row = worksheet.row_count
 
-    rules = run_with_retry(get_conditional_format_rules, worksheet)
+    rules = await run_with_retry(READ, get_conditional_format_rules, worksheet)
     rules.clear()
 
     for user_col in existing_users.values():
@@ -455,107 +729,99 @@ def sync_update_monitor_accounts_data(users_data: list[dict]):
             )
         ))
 
-    run_with_retry(rules.save)
-    run_with_retry(worksheet.batch_format, batch_formats)
+    await run_with_retry(WRITE, rules.save)
+    await run_with_retry(WRITE, worksheet.batch_format, batch_formats)
 
 
-async def update_monitor_accounts_data(users_data: list[dict]):
-    await asyncio.to_thread(sync_update_monitor_accounts_data, users_data)
-
-
-def sync_update_monitor_posts_data(posts_data: list[dict]):
-    spreadsheet = client.open(MAIN_SHEET)
-    worksheet = spreadsheet.worksheet(MONITOR_POSTS_WORKSHEET)
-
-    header = [
-        'Дата обнаруж', 'Аккаунт', 'ФИО', 'ID', 'URL',
-        'Название статьи', 'Просмотры', 'Добавлено', 'Дн публ'
-    ]
-
-    existing_header = run_with_retry(worksheet.row_values, 1)
-    if existing_header != header:
-        run_with_retry(worksheet.update, 'A1:I1', [header])
-        run_with_retry(worksheet.freeze, rows=1)
+def monitor_posts_setup_requests(sheet: dict) -> list[dict]:
+    sheet_id = sheet['properties']['sheetId']
+    batch_requests = [{
+        'updateCells': {
+            'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+            'rows': [{'values': [to_cell_data(value) for value in MONITOR_POSTS_HEADER]}],
+            'fields': 'userEnteredValue'
+        }
+    }, {
+        'updateSheetProperties': {
+            'properties': {'sheetId': sheet_id, 'gridProperties': {'frozenRowCount': 1}},
+            'fields': 'gridProperties.frozenRowCount'
+        }
+    }]
 
-        widths = [91, 215, 169, 63, 100, 400, 75, 73, 55]
-        for offset, width in enumerate(widths):
-            col_letter = rowcol_to_a1(1, offset + 1).replace('1', '')
-            run_with_retry(set_column_width, worksheet, col_letter, width)
+    widths = [91, 215, 169, 63, 100, 400, 75, 73, 55]
+    for offset, width in enumerate(widths):
+        col_letter = rowcol_to_a1(1, offset + 1).replace('1', '')
+        batch_requests.append(column_width_request(sheet_id, col_letter, width))
 
-    rows_to_append = []
-    now = datetime.now(MOSCOW_TIMEZONE)
+    batch_requests.extend([
+        format_request(sheet_id, 'A2:A', DATE_FORMAT),
+        format_request(sheet_id, 'H2:H', DATE_FORMAT),
+        format_request(sheet_id, 'I2:I', DAYS_FORMAT)
+    ])
 
-    data_rows = run_with_retry(worksheet.get_all_values)
-    last_filled_row = len(data_rows)
+    batch_requests.extend({'deleteConditionalFormatRule': {'sheetId': sheet_id, 'index': 0}} for _ in sheet.get('conditionalFormats', []))
+    batch_requests.append(gradient_rule_request(sheet_id, 'G2:G', RED_COLOR, YELLOW_COLOR, GREEN_COLOR))
+    return batch_requests
 
-    for index, post in enumerate(posts_data):
-        row_number = last_filled_row + index + 1
-        days_since_formula = f'=A{row_number} - H{row_number}'
 
-        rows_to_append.append([
-            now.strftime('%d.%m.%y %H:%M:%S'),
+@operation
+async def update_monitor_posts_data(posts_data: list[dict]):
+    global MONITOR_POSTS_PREPARED
+    if not posts_data:
+        return
+
+    spreadsheet = await get_spreadsheet()
+    sheet = await get_sheet_metadata(MONITOR_POSTS_WORKSHEET)
+    if not sheet:
+        raise WorksheetNotFound(MONITOR_POSTS_WORKSHEET)
+
+    batch_requests = [] if MONITOR_POSTS_PREPARED else monitor_posts_setup_requests(sheet)
+    now = datetime.now(MOSCOW_TIMEZONE).replace(tzinfo=None)
+
+    rows = []
+    for post in posts_data:
+        cells = [to_cell_data(value) for value in [
+            to_serial_date(now),
             post['account_url'],
             post['name'],
             post['post_id'],
             post['post_url'],
             post['post_title'],
             post['views'],
-            post['publish_date'].strftime('%d.%m.%y %H:%M:%S'),
-            days_since_formula
-        ])
-
-    if rows_to_append:
-        run_with_retry(worksheet.append_rows, rows_to_append, value_input_option='USER_ENTERED')
-
-    batch_formats = []
-    last_row = worksheet.row_count
-
-    rules = run_with_retry(get_conditional_format_rules, worksheet)
-    rules.clear()
-
-    for col_idx in [1, 8]:
-        col_letter = rowcol_to_a1(1, col_idx).replace('1', '')
-        batch_formats.append({
-            'range': f'{col_letter}2:{col_letter}{last_row}',
-            'format': DATE_FORMAT
-        })
-
-    col_letter = rowcol_to_a1(1, 9).replace('1', '')
-    batch_formats.append({
-        'range': f'{col_letter}2:{col_letter}{last_row}',
-        'format': {
-            'numberFormat': {
-                'type': 'NUMBER',
-                'pattern': '0'
-            }
+            to_serial_date(post['publish_date']),
+            (now - post['publish_date']) / timedelta(days=1)
+        ]]
+
+        cells[0]['userEnteredFormat'] = DATE_FORMAT
+        cells[7]['userEnteredFormat'] = DATE_FORMAT
+        cells[8]['userEnteredFormat'] = DAYS_FORMAT
+        rows.append({'values': cells})
+
+    batch_requests.append({
+        'appendCells': {
+            'sheetId': sheet['properties']['sheetId'],
+            'rows': rows,
+            'fields': 'userEnteredValue,userEnteredFormat'
         }
     })
 
-    views_col = rowcol_to_a1(1, 7).replace('1', '')
-    rules.append(ConditionalFormatRule(
-        ranges=[GridRange.from_a1_range(f'{views_col}2:{views_col}{last_row}', worksheet)],
-        gradientRule=GradientRule(
-            minpoint=InterpolationPoint(type='MIN', color=Color(0.910, 0.486, 0.455)),
-            midpoint=InterpolationPoint(type='PERCENTILE', value='50', color=Color(1.0, 0.831, 0.392)),
-            maxpoint=InterpolationPoint(type='MAX', color=Color(0.345, 0.737, 0.549))
-        )
-    ))
-
-    run_with_retry(rules.save)
-    run_with_retry(worksheet.batch_format, batch_formats)
-
+    try:
+        await run_with_retry(WRITE, spreadsheet.batch_update, {'requests': batch_requests})
+    except Exception:
+        invalidate_sheet_metadata(MONITOR_POSTS_WORKSHEET)
+        raise
 
-async def update_monitor_posts_data(posts_data: list[dict]):
-    await asyncio.to_thread(sync_update_monitor_posts_data, posts_data)
+    MONITOR_POSTS_PREPARED = True
+    add_monitor_posts_ids({post['post_id'] for post in posts_data})
 
 
-def sync_get_monitor_posts_ids() -> List[int]:
-    spreadsheet = client.open(MAIN_SHEET)
-    worksheet = spreadsheet.worksheet(MONITOR_POSTS_WORKSHEET)
+@operation
+async def read_monitor_posts_ids() -> Set[int]:
+    worksheet = await get_worksheet(MONITOR_POSTS_WORKSHEET)
 
-    data = run_with_retry(worksheet.get_all_values)
+    data = await run_with_retry(READ, worksheet.get_all_values)
     if not data or len(data) < 2:
-        return []
+        return set()
 
     try:
         header = data[0]
@@ -563,27 +829,31 @@ def sync_get_monitor_posts_ids() -> List[int]:
     except ValueError:
         raise RuntimeError('Не найден столбец "ID" в листе мониторинга постов.')
 
-    monitor_post_ids = []
+    monitor_post_ids = set()
     for row in data[1:]:
         if len(row) > id_index:
             post_id = row[id_index].strip()
             if post_id:
-                monitor_post_ids.append(int(post_id))
+                monitor_post_ids.add(int(post_id))
 
     return monitor_post_ids
 
 
-async def get_monitor_posts_ids() -> List[int]:
-    return await asyncio.to_thread(sync_get_monitor_posts_ids)
+async def get_monitor_posts_ids() -> Set[int]:
+    global MONITOR_POSTS_IDS
+    async with MONITOR_POSTS_LOCK:
+        if MONITOR_POSTS_IDS is None:
+            monitor_posts_ids = storage.get_monitor_post_ids()
+            if not monitor_posts_ids:
+                monitor_posts_ids = await read_monitor_posts_ids()
+                storage.add_monitor_post_ids(monitor_posts_ids)
 
+            MONITOR_POSTS_IDS = monitor_posts_ids
+
+    return MONITOR_POSTS_IDS
 
-def run_with_retry(func, *args, attempt=5, **kwargs):
-    for attempt in range(attempt):
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            wait = 4 ** attempt + random.uniform(0, 1)
-            print(f'⏳ Ошибка: {e}. Ждём {wait:.1f} сек...')
-            time.sleep(wait)
 
-    raise RuntimeError(f'❌ Превышено число попыток вызова {func.__name__}', e)
+def add_monitor_posts_ids(post_ids: Set[int]):
+    if MONITOR_POSTS_IDS is not None:
+        MONITOR_POSTS_IDS.update(post_ids)
+    storage.add_monitor_post_ids(post_ids)
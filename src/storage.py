@@ -1,10 +1,94 @@
+import asyncio
 import os
+import threading
 from datetime import datetime, time, UTC
-from typing import List, Optional
+from typing import List, Optional, Dict, Type, Set, Tuple, Callable
 
 from pydantic import BaseModel
+from rewire import simple_plugin
+from sqlalchemy import create_engine, Engine, Connection, MetaData, Table, Column, Integer, String, Boolean, Text, DateTime, Float, select, insert, delete, and_, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+plugin = simple_plugin()
 
 STORAGE_PATH = 'storage/storage.json'
+DATABASE_PATH = 'storage/storage.db'
+FLUSH_DELAY = 2
+
+metadata = MetaData()
+
+accounts_table = Table(
+    'accounts', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('url', String, nullable=False),
+    Column('mode', String, nullable=False, index=True),
+    Column('domain', String, nullable=False, index=True),
+    Column('username', String, nullable=False, index=True),
+    Column('name', String),
+    Column('last_post_id', Integer),
+    Column('last_url', String),
+    Column('is_blocked', Boolean, nullable=False, default=False, index=True)
+)
+
+last_failed_accounts_table = Table(
+    'last_failed_accounts', metadata,
+    Column('position', Integer, primary_key=True, autoincrement=True),
+    Column('data', Text, nullable=False)
+)
+
+settings_table = Table(
+    'settings', metadata,
+    Column('key', String, primary_key=True),
+    Column('value', Text, nullable=False)
+)
+
+media_blobs_table = Table(
+    'media_blobs', metadata,
+    Column('key', String, primary_key=True),
+    Column('digest', String, nullable=False, index=True),
+    Column('extension', String, nullable=False)
+)
+
+known_posts_table = Table(
+    'known_posts', metadata,
+    Column('domain', String, primary_key=True),
+    Column('username', String, primary_key=True),
+    Column('post_id', Integer, primary_key=True),
+    Column('post_url', String, nullable=False),
+    Column('post_title', String, nullable=False),
+    Column('views', Integer, nullable=False),
+    Column('publish_date', DateTime, nullable=False)
+)
+
+known_posts_indexes_table = Table(
+    'known_posts_indexes', metadata,
+    Column('domain', String, primary_key=True),
+    Column('username', String, primary_key=True)
+)
+
+monitor_posts_table = Table(
+    'monitor_posts', metadata,
+    Column('post_id', Integer, primary_key=True)
+)
+
+resolutions_table = Table(
+    'resolutions', metadata,
+    Column('url', String, primary_key=True),
+    Column('account_url', String, nullable=False),
+    Column('domain', String, nullable=False, index=True),
+    Column('username', String, nullable=False),
+    Column('user_id', Integer),
+    Column('found', Boolean, nullable=False),
+    Column('expires_at', Float, nullable=False)
+)
+
+ENGINE: Optional[Engine] = None
+ENGINE_LOCK = threading.Lock()
+STORAGE: Optional['StorageData'] = None
+DIRTY_KEYS: Set[str] = set()
+DIRTY_ACCOUNT_IDS: Set[int] = set()
+FLUSH_HANDLE: Optional[asyncio.TimerHandle] = None
+SUBSCRIBERS: List[Callable[[str], None]] = []
 
 
 class Account(BaseModel):
@@ -19,6 +103,23 @@ class Account(BaseModel):
     is_blocked: bool = False
 
 
+class KnownPost(BaseModel):
+    post_id: int
+    post_url: str
+    post_title: str
+    views: int
+    publish_date: datetime
+
+
+class Resolution(BaseModel):
+    account_url: str = ''
+    domain: str = ''
+    username: str = ''
+    user_id: Optional[int] = None
+    found: bool = True
+    expires_at: float
+
+
 class Periodicity(BaseModel):
     interval: int
     time: time
@@ -66,46 +167,214 @@ class StorageData(BaseModel):
     tenchat_auth_data: Optional[TenchatAuthData] = None
 
 
-def load_storage() -> StorageData:
+SETTINGS_MODELS: Dict[str, Type[BaseModel]] = {
+    'regular_parsing': RegularParsingSettings,
+    'monitor_accounts': MonitorAccountsSettings,
+    'monitor_posts': MonitorPostsSettings,
+    'tenchat_auth_data': TenchatAuthData
+}
+
+
+def get_engine() -> Engine:
+    global ENGINE
+    with ENGINE_LOCK:
+        if ENGINE is None:
+            os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+            engine = create_engine(f'sqlite:///{DATABASE_PATH}')
+            metadata.create_all(engine)
+            migrate_json_storage(engine)
+            ENGINE = engine
+
+    return ENGINE
+
+
+def migrate_json_storage(engine: Engine):
     if not os.path.exists(STORAGE_PATH):
-        return StorageData()
+        return
 
     with open(STORAGE_PATH, 'r', encoding='utf-8') as file:
-        return StorageData.model_validate_json(file.read())
+        storage_data = StorageData.model_validate_json(file.read())
+
+    with engine.begin() as connection:
+        write_storage(connection, storage_data)
+
+    os.replace(STORAGE_PATH, f'{STORAGE_PATH}.migrated')
+
+
+def write_storage(connection: Connection, data: StorageData):
+    connection.execute(delete(accounts_table))
+    connection.execute(delete(last_failed_accounts_table))
+    connection.execute(delete(settings_table))
+
+    if data.accounts:
+        connection.execute(insert(accounts_table), [account.model_dump() for account in data.accounts])
+
+    if data.last_failed_accounts:
+        connection.execute(insert(last_failed_accounts_table), [{'data': account.model_dump_json()} for account in data.last_failed_accounts])
+
+    for key in SETTINGS_MODELS:
+        value = getattr(data, key)
+        if value is not None:
+            write_setting(connection, key, value)
+
+
+def read_setting(connection: Connection, key: str) -> Optional[BaseModel]:
+    value = connection.execute(select(settings_table.c.value).where(settings_table.c.key == key)).scalar()
+    if value is None:
+        return getattr(StorageData(), key)
+
+    return SETTINGS_MODELS[key].model_validate_json(value)
+
+
+def write_setting(connection: Connection, key: str, value: Optional[BaseModel]):
+    connection.execute(delete(settings_table).where(settings_table.c.key == key))
+    if value is not None:
+        connection.execute(insert(settings_table).values(key=key, value=value.model_dump_json()))
+
+
+def read_storage() -> StorageData:
+    with get_engine().connect() as connection:
+        return StorageData(
+            accounts=[Account.model_validate(dict(row._mapping)) for row in connection.execute(select(accounts_table).order_by(accounts_table.c.id))],
+            last_failed_accounts=[Account.model_validate_json(data) for data in connection.execute(select(last_failed_accounts_table.c.data).order_by(last_failed_accounts_table.c.position)).scalars()],
+            **{key: read_setting(connection, key) for key in SETTINGS_MODELS}
+        )
+
+
+def get_storage() -> StorageData:
+    global STORAGE
+    if STORAGE is None:
+        STORAGE = read_storage()
+    return STORAGE
+
+
+def mark_dirty(key: Optional[str] = None, account_id: Optional[int] = None):
+    if key:
+        DIRTY_KEYS.add(key)
+    if account_id is not None:
+        DIRTY_ACCOUNT_IDS.add(account_id)
+
+    schedule_flush()
+
+
+def schedule_flush():
+    global FLUSH_HANDLE
+    if FLUSH_HANDLE:
+        return
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return flush_storage()
+
+    FLUSH_HANDLE = loop.call_later(FLUSH_DELAY, flush_storage)
+
+
+def flush_storage():
+    global FLUSH_HANDLE
+    if FLUSH_HANDLE:
+        FLUSH_HANDLE.cancel()
+        FLUSH_HANDLE = None
+
+    if not DIRTY_KEYS and not DIRTY_ACCOUNT_IDS:
+        return
+
+    storage_data = get_storage()
+    with get_engine().begin() as connection:
+        if 'storage' in DIRTY_KEYS:
+            write_storage(connection, storage_data)
+        else:
+            if DIRTY_ACCOUNT_IDS:
+                connection.execute(delete(accounts_table).where(accounts_table.c.id.in_(DIRTY_ACCOUNT_IDS)))
+                dirty_accounts = [account.model_dump() for account in storage_data.accounts if account.id in DIRTY_ACCOUNT_IDS]
+                if dirty_accounts:
+                    connection.execute(insert(accounts_table), dirty_accounts)
+
+            if 'last_failed_accounts' in DIRTY_KEYS:
+                connection.execute(delete(last_failed_accounts_table))
+                if storage_data.last_failed_accounts:
+                    connection.execute(insert(last_failed_accounts_table), [{'data': account.model_dump_json()} for account in storage_data.last_failed_accounts])
+
+            for key in SETTINGS_MODELS:
+                if key in DIRTY_KEYS:
+                    write_setting(connection, key, getattr(storage_data, key))
+
+    DIRTY_KEYS.clear()
+    DIRTY_ACCOUNT_IDS.clear()
+
+
+def subscribe(callback: Callable[[str], None]):
+    SUBSCRIBERS.append(callback)
+
+
+def notify_subscribers(key: str):
+    for callback in SUBSCRIBERS:
+        callback(key)
+
+
+def get_setting(key: str) -> Optional[BaseModel]:
+    value = getattr(get_storage(), key)
+    return value.model_copy() if value is not None else None
+
+
+def set_setting(key: str, value: Optional[BaseModel]):
+    setattr(get_storage(), key, value.model_copy() if value is not None else None)
+    mark_dirty(key)
+    notify_subscribers(key)
+
+
+def load_storage() -> StorageData:
+    return get_storage().model_copy(deep=True)
 
 
 def save_storage(data: StorageData):
-    with open(STORAGE_PATH, 'w', encoding='utf-8') as file:
-        file.write(data.model_dump_json(indent=2))
+    global STORAGE
+    STORAGE = data.model_copy(deep=True)
+    mark_dirty('storage')
+    notify_subscribers('storage')
 
 
-def get_accounts() -> List[Account]:
-    return load_storage().accounts
+def get_accounts(**filters) -> List[Account]:
+    return [
+        account.model_copy() for account in get_storage().accounts
+        if all(getattr(account, key) == value for key, value in filters.items())
+    ]
 
 
 def get_account(account_id: int) -> Optional[Account]:
-    return next((account for account in get_accounts() if account.id == account_id), None)
+    account = next((account for account in get_storage().accounts if account.id == account_id), None)
+    return account.model_copy() if account else None
 
 
 def add_account(**kwargs):
-    storage_data = load_storage()
-    storage_data.accounts.append(Account(id=get_next_account_id(storage_data.accounts), **kwargs))
-    save_storage(storage_data)
+    storage_data = get_storage()
+    account = Account(id=get_next_account_id(storage_data.accounts), **kwargs)
+    storage_data.accounts.append(account)
+    mark_dirty(account_id=account.id)
 
 
 def update_account(account_id: int, **kwargs):
-    storage_data = load_storage()
-    for account in storage_data.accounts:
+    for account in get_storage().accounts:
         if account.id == account_id:
             account.__dict__.update(**kwargs)
+            mark_dirty(account_id=account_id)
             break
-    save_storage(storage_data)
+
+
+def update_accounts(accounts_updates: Dict[int, dict]):
+    for account in get_storage().accounts:
+        if account.id in accounts_updates:
+            account.__dict__.update(**accounts_updates[account.id])
+            DIRTY_ACCOUNT_IDS.add(account.id)
+
+    if accounts_updates:
+        schedule_flush()
 
 
 def delete_account(account_id: int):
-    storage_data = load_storage()
+    storage_data = get_storage()
     storage_data.accounts = [account for account in storage_data.accounts if account.id != account_id]
-    save_storage(storage_data)
+    mark_dirty(account_id=account_id)
 
 
 def get_next_account_id(accounts: List[Account]) -> int:
@@ -113,99 +382,178 @@ def get_next_account_id(accounts: List[Account]) -> int:
 
 
 def get_last_failed_accounts() -> List[Account]:
-    return load_storage().last_failed_accounts
+    return [account.model_copy() for account in get_storage().last_failed_accounts]
 
 
 def add_last_failed_accounts(last_failed_accounts: List[Account]):
-    storage_data = load_storage()
-    storage_data.last_failed_accounts.extend(last_failed_accounts)
-    save_storage(storage_data)
+    get_storage().last_failed_accounts.extend(account.model_copy() for account in last_failed_accounts)
+    mark_dirty('last_failed_accounts')
 
 
 def clear_last_failed_accounts():
-    storage_data = load_storage()
-    storage_data.last_failed_accounts = []
-    save_storage(storage_data)
+    get_storage().last_failed_accounts = []
+    mark_dirty('last_failed_accounts')
 
 
 def get_regular_parsing_settings() -> RegularParsingSettings:
-    return load_storage().regular_parsing
+    return get_setting('regular_parsing')
 
 
 def toggle_regular_parsing() -> bool:
-    storage_data = load_storage()
-    storage_data.regular_parsing.enabled = not storage_data.regular_parsing.enabled
-    save_storage(storage_data)
-    return storage_data.regular_parsing.enabled
+    settings = get_regular_parsing_settings()
+    settings.enabled = not settings.enabled
+    set_setting('regular_parsing', settings)
+    return settings.enabled
 
 
 def get_regular_parsing_periodicity() -> Optional[Periodicity]:
-    return load_storage().regular_parsing.periodicity
+    return get_regular_parsing_settings().periodicity
 
 
 def set_regular_parsing_periodicity(interval: int, time: time):
-    storage_data = load_storage()
-    storage_data.regular_parsing.periodicity = Periodicity(interval=interval, time=time)
-    save_storage(storage_data)
+    settings = get_regular_parsing_settings()
+    settings.periodicity = Periodicity(interval=interval, time=time)
+    set_setting('regular_parsing', settings)
 
 
 def update_regular_parsing_last_run():
-    storage_data = load_storage()
-    storage_data.regular_parsing.last_run = datetime.now(UTC)
-    save_storage(storage_data)
+    settings = get_regular_parsing_settings()
+    settings.last_run = datetime.now(UTC)
+    set_setting('regular_parsing', settings)
 
 
 def set_monitor_accounts_settings(settings: MonitorAccountsSettings):
-    storage_data = load_storage()
-    storage_data.monitor_accounts = settings
-    save_storage(storage_data)
+    set_setting('monitor_accounts', settings)
 
 
 def get_monitor_accounts_settings() -> MonitorAccountsSettings:
-    return load_storage().monitor_accounts
+    return get_setting('monitor_accounts')
 
 
 def toggle_monitor_accounts() -> bool:
-    storage_data = load_storage()
-    storage_data.monitor_accounts.enabled = not storage_data.monitor_accounts.enabled
-    save_storage(storage_data)
-    return storage_data.monitor_accounts.enabled
+    settings = get_monitor_accounts_settings()
+    settings.enabled = not settings.enabled
+    set_setting('monitor_accounts', settings)
+    return settings.enabled
 
 
 def update_monitor_accounts_last_run():
-    storage_data = load_storage()
-    storage_data.monitor_accounts.last_run = datetime.now(UTC)
-    save_storage(storage_data)
+    settings = get_monitor_accounts_settings()
+    settings.last_run = datetime.now(UTC)
+    set_setting('monitor_accounts', settings)
 
 
 def set_monitor_posts_settings(settings: MonitorPostsSettings):
-    storage_data = load_storage()
-    storage_data.monitor_posts = settings
-    save_storage(storage_data)
+    set_setting('monitor_posts', settings)
 
 
 def get_monitor_posts_settings() -> MonitorPostsSettings:
-    return load_storage().monitor_posts
+    return get_setting('monitor_posts')
 
 
 def toggle_monitor_posts() -> bool:
-    storage_data = load_storage()
-    storage_data.monitor_posts.enabled = not storage_data.monitor_posts.enabled
-    save_storage(storage_data)
-    return storage_data.monitor_posts.enabled
+    settings = get_monitor_posts_settings()
+    settings.enabled = not settings.enabled
+    set_setting('monitor_posts', settings)
+    return settings.enabled
 
 
 def update_monitor_posts_last_run():
-    storage_data = load_storage()
-    storage_data.monitor_posts.last_run = datetime.now(UTC)
-    save_storage(storage_data)
+    settings = get_monitor_posts_settings()
+    settings.last_run = datetime.now(UTC)
+    set_setting('monitor_posts', settings)
+
+
+def get_media_blobs(keys: List[str]) -> Dict[str, Tuple[str, str]]:
+    with get_engine().connect() as connection:
+        rows = connection.execute(
+            select(media_blobs_table.c.key, media_blobs_table.c.digest, media_blobs_table.c.extension)
+            .where(media_blobs_table.c.key.in_(keys))
+        )
+        return {key: (digest, extension) for key, digest, extension in rows}
+
+
+def set_media_blobs(blobs: Dict[str, Tuple[str, str]]):
+    with get_engine().begin() as connection:
+        connection.execute(delete(media_blobs_table).where(media_blobs_table.c.key.in_(blobs)))
+        connection.execute(insert(media_blobs_table), [
+            {'key': key, 'digest': digest, 'extension': extension}
+            for key, (digest, extension) in blobs.items()
+        ])
+
+
+def get_known_posts(domain: str, username: str) -> Optional[List[KnownPost]]:
+    with get_engine().connect() as connection:
+        rows = connection.execute(
+            select(known_posts_table)
+            .where(known_posts_table.c.domain == domain, known_posts_table.c.username == username)
+            .order_by(known_posts_table.c.post_id.desc())
+        )
+        known_posts = [KnownPost.model_validate(dict(row._mapping)) for row in rows]
+
+        indexed = connection.execute(
+            select(known_posts_indexes_table)
+            .where(known_posts_indexes_table.c.domain == domain, known_posts_indexes_table.c.username == username)
+        ).first()
+        return known_posts if known_posts or indexed else None
+
+
+def set_known_posts(domain: str, username: str, known_posts: List[KnownPost]):
+    with get_engine().begin() as connection:
+        connection.execute(delete(known_posts_table).where(known_posts_table.c.domain == domain, known_posts_table.c.username == username))
+        connection.execute(sqlite_insert(known_posts_indexes_table).values(domain=domain, username=username).on_conflict_do_nothing())
+        if known_posts:
+            connection.execute(insert(known_posts_table), [{'domain': domain, 'username': username, **post.model_dump()} for post in known_posts])
+
+
+def get_monitor_post_ids() -> Set[int]:
+    with get_engine().connect() as connection:
+        return set(connection.execute(select(monitor_posts_table.c.post_id)).scalars())
+
+
+def add_monitor_post_ids(post_ids: Set[int]):
+    if not post_ids:
+        return
+
+    with get_engine().begin() as connection:
+        connection.execute(sqlite_insert(monitor_posts_table).on_conflict_do_nothing(), [{'post_id': post_id} for post_id in post_ids])
+
+
+def get_resolution(url: str) -> Optional[Resolution]:
+    with get_engine().connect() as connection:
+        row = connection.execute(select(resolutions_table).where(resolutions_table.c.url == url)).first()
+        return Resolution.model_validate(dict(row._mapping)) if row else None
+
+
+def set_resolution(url: str, resolution: Resolution):
+    with get_engine().begin() as connection:
+        connection.execute(
+            sqlite_insert(resolutions_table)
+            .values(url=url, **resolution.model_dump())
+            .on_conflict_do_update(index_elements=['url'], set_=resolution.model_dump())
+        )
+
+
+def delete_resolutions(urls: Set[str], domain: str, username: str):
+    with get_engine().begin() as connection:
+        connection.execute(delete(resolutions_table).where(or_(
+            resolutions_table.c.url.in_(urls),
+            and_(resolutions_table.c.domain == domain, resolutions_table.c.username == username)
+        )))
 
 
 def get_tenchat_auth_data() -> Optional[TenchatAuthData]:
-    return load_storage().tenchat_auth_data
+    return get_setting('tenchat_auth_data')
 
 
 def set_tenchat_auth_data(tenchat_auth_data: Optional[TenchatAuthData]):
-    storage_data = load_storage()
-    storage_data.tenchat_auth_data = tenchat_auth_data
-    save_storage(storage_data)
+    set_setting('tenchat_auth_data', tenchat_auth_data)
+    flush_storage()
+
+
+@plugin.run()
+async def flush_storage_on_shutdown():
+    try:
+        await asyncio.Future()
+    finally:
+        flush_storage()
@@ -0,0 +1,70 @@
+import json
+import os
+import tempfile
+from typing import List, Dict, Set, Iterator, AsyncIterator
+
+from src import api, limits
+
+POSTS_DIRECTORY = 'storage/posts'
+CACHED_PAGE_SIZE = 50
+
+
+def get_posts_path(domain: str, username: str) -> str:
+    return os.path.join(POSTS_DIRECTORY, f'{domain.split(".")[0]}-{username}.jsonl')
+
+
+def iter_cached_posts(domain: str, username: str) -> Iterator[Dict]:
+    posts_path = get_posts_path(domain, username)
+    if not os.path.exists(posts_path):
+        return
+
+    with open(posts_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_cached_ids(domain: str, username: str) -> Set[int]:
+    return {post['id'] for post in iter_cached_posts(domain, username)}
+
+
+async def iter_account_posts(domain: str, username: str, full_resync: bool = False) -> AsyncIterator[List[Dict]]:
+    os.makedirs(POSTS_DIRECTORY, exist_ok=True)
+    posts_path = get_posts_path(domain, username)
+
+    async with limits.get_lock(posts_path):
+        known_ids = set() if full_resync else load_cached_ids(domain, username)
+        new_ids = set()
+
+        pages = api.iter_tenchat_posts(username, known_ids=known_ids) \
+            if domain == 'tenchat.ru' else \
+            api.iter_user_posts(domain, username, known_ids=known_ids)
+
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=POSTS_DIRECTORY, suffix='.tmp', delete=False) as file:
+            try:
+                async for posts in pages:
+                    for post in posts:
+                        file.write(json.dumps(post, ensure_ascii=False) + '\n')
+                        new_ids.add(post['id'])
+                    yield posts
+
+                cached_posts = []
+                for post in ([] if full_resync else iter_cached_posts(domain, username)):
+                    if post['id'] in new_ids:
+                        continue
+
+                    file.write(json.dumps(post, ensure_ascii=False) + '\n')
+                    cached_posts.append(post)
+
+                    if len(cached_posts) >= CACHED_PAGE_SIZE:
+                        yield cached_posts
+                        cached_posts = []
+
+                if cached_posts:
+                    yield cached_posts
+            except BaseException:
+                file.close()
+                os.remove(file.name)
+                raise
+
+        os.replace(file.name, posts_path)
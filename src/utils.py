@@ -1,18 +1,27 @@
+import asyncio
 import json
 import os
 import re
+import textwrap
+import time
+import uuid
 from datetime import datetime, date
-from typing import Any
+from typing import Any, AsyncIterable, AsyncIterator, List
 from typing import Optional, Tuple
 from urllib.parse import unquote, parse_qs, urlunparse
 from urllib.parse import urlparse
 
+import aiofiles
 import pytz
-from aiohttp import ClientSession
+from rewire import logger
 
-from src import sheets, api
+from src import sheets, api, media, storage, limits, resolver
+from src.storage import KnownPost
 
 OUTPUT_DIRECTORY = 'output'
+MEDIA_HOST = 'leonardo.osnova.io'
+PAGES_QUEUE_SIZE = 2
+MESSAGE_LIMIT = 4096
 LINK_TAG_PATTERN = r'<a\s+[^>]*?href=("(.*?)")[^>]*>'
 
 
@@ -23,7 +32,11 @@ def parse_time(text: str):
         return None
 
 
-async def parse_url(url: str) -> Optional[Tuple[str, str, str]]:
+async def parse_url(url: str, use_negative_cache: bool = False) -> Optional[Tuple[str, str, str]]:
+    resolution = resolver.get_resolution(url)
+    if resolution and (resolution.found or use_negative_cache):
+        return (resolution.account_url, resolution.domain, resolution.username) if resolution.found else None
+
     parsed = urlparse(url)
     domain = parsed.netloc.lower()
     path = parsed.path.strip('/')
@@ -33,13 +46,10 @@ async def parse_url(url: str) -> Optional[Tuple[str, str, str]]:
 
     if domain == 'tenchat.ru':
         default_username = await api.fetch_tenchat_default_username(path)
-        username = default_username or path
-
-        if default_username:
-            parsed = parsed._replace(path=f'/{default_username}')
-            url = urlunparse(parsed)
+        if not default_username:
+            return url, domain, path
 
-        return url, domain, username  # type: ignore
+        return resolver.remember(url, urlunparse(parsed._replace(path=f'/{default_username}')), domain, default_username)
 
     match = re.match(r'(id(\d+))|u/(\d+)-([\w\-]+)|([\w\-]+)', path)
     if not match:
@@ -48,7 +58,58 @@ async def parse_url(url: str) -> Optional[Tuple[str, str, str]]:
     user_id = match.group(2) or match.group(3)
     username = match.group(4) or match.group(5) or f'id{user_id}'
 
-    return url, domain, username
+    return resolver.remember(url, url, domain, username, int(user_id) if user_id else None)
+
+
+async def resolve_account_id(account_url: str) -> str:
+    async with limits.slot(urlparse(account_url).netloc.lower()):
+        parsed_args = await parse_url(account_url, use_negative_cache=True)
+        if not parsed_args:
+            return f'{account_url} — ❌'
+
+        account_url, domain, username = parsed_args
+        if domain == 'tenchat.ru':
+            return account_url
+
+        resolution = resolver.get_resolution(account_url)
+        user_id = resolution.user_id if resolution else None
+
+        if not user_id:
+            status, user_id = await api.fetch_user_id(domain, username)
+            if status == 404:
+                resolver.forget(account_url, domain, username)
+            if not user_id:
+                return f'{account_url} — ❌'
+
+            resolver.remember(account_url, account_url, domain, username, user_id)
+
+    return f'https://{domain}/id{user_id}'
+
+
+async def resolve_account_ids(account_urls: List[str]) -> AsyncIterator[Tuple[str, str]]:
+    async def resolve(account_url: str) -> Tuple[str, str]:
+        try:
+            return account_url, await resolve_account_id(account_url)
+        except Exception as e:
+            logger.error(f'Ошибка при получении ID для {account_url}: {e}')
+            return account_url, f'{account_url} — ❌'
+
+    tasks = [asyncio.create_task(resolve(account_url)) for account_url in account_urls]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def split_message(lines: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    chunks = ['']
+    for line in lines:
+        if chunks[-1] and len(chunks[-1]) + len(line) + 1 > limit:
+            chunks.append('')
+        chunks[-1] = f'{chunks[-1]}\n{line}' if chunks[-1] else line
+    return chunks
 
 
 def replace_redirect_links(href: str) -> str:
@@ -82,124 +143,190 @@ def clean_json_links(data: Any) -> Any:
     return data
 
 
-async def download_posts_files(domain: str, username: str, user_posts: list, last_post_id: Optional[int] = None):
+async def download_post_files(domain: str, post_directory: str, post_data: dict, stats: dict):
+    os.makedirs(post_directory, exist_ok=True)
+
+    if domain == 'tenchat.ru':
+        files = [
+            (picture['link'], picture['link'], f'image_{index}', 'jpg', picture)
+            for index, picture in enumerate(post_data.get('pictures', []))
+            if picture.get('link')
+        ]
+    else:
+        files = [
+            (image_data['uuid'], f'https://{MEDIA_HOST}/{image_data['uuid']}', image_data['uuid'], image_data['type'], image_data)
+            for block in post_data['blocks'] if block['type'] == 'media'
+            for image_data in [item['image']['data'] for item in block['data']['items']]
+        ]
+
+    blobs = await media.load_blobs([key for key, *_ in files])
+    new_blobs = {}
+
+    async def download(key: str, url: str, name: str, default_extension: str, file_data: dict):
+        file_path = await media.download_file(key, url, post_directory, name, default_extension, stats, blobs, new_blobs)
+        if file_path:
+            file_data['path'] = file_path
+
+    await asyncio.gather(*[download(*file) for file in files])
+    await media.save_blobs(new_blobs)
+
+    post_json_path = os.path.join(post_directory, 'data.json')
+    async with aiofiles.open(post_json_path, 'w+') as post_file:
+        await post_file.write(json.dumps(clean_json_links(post_data), ensure_ascii=False, indent=4))
+
+
+async def download_posts_files(domain: str, username: str, pages: AsyncIterable[list], last_post_id: Optional[int] = None):
     user_directory = os.path.join(OUTPUT_DIRECTORY, f'{domain.split('.')[0]}-{username}')
     os.makedirs(user_directory, exist_ok=True)
 
-    async with ClientSession() as session:
-        for post_data in user_posts:
-            if last_post_id and post_data['id'] <= last_post_id:
-                continue
+    stats = {'files': 0, 'cached': 0, 'deduplicated': 0, 'bytes': 0}
+    started_at = time.monotonic()
 
-            post_directory = os.path.join(user_directory, str(post_data['id']))
-            os.makedirs(post_directory, exist_ok=True)
+    pages = aiter(pages)
+    first_posts = await anext(pages, None)
 
-            if domain == 'tenchat.ru':
-                pictures = post_data.get('pictures', [])
-                for index, picture in enumerate(pictures):
-                    link = picture.get('link')
-                    if not link:
-                        continue
+    async def iter_locked_pages() -> AsyncIterator[list]:
+        if first_posts is not None:
+            yield first_posts
+        async for posts in pages:
+            yield posts
 
-                    async with session.get(link) as response:
-                        if not response.ok:
-                            continue
+    user_posts_path = os.path.join(user_directory, 'posts.json')
+    async with limits.get_lock(user_posts_path):
+        temp_path = f'{user_posts_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            async with aiofiles.open(temp_path, 'w') as user_posts_file:
+                posts_count = 0
+                async for user_posts in iter_locked_pages():
+                    await asyncio.gather(*[
+                        download_post_files(domain, os.path.join(user_directory, str(post_data['id'])), post_data, stats)
+                        for post_data in user_posts
+                        if not last_post_id or post_data['id'] > last_post_id
+                    ])
+
+                    for post_data in user_posts:
+                        post_json = textwrap.indent(json.dumps(clean_json_links(post_data), ensure_ascii=False, indent=4), '    ')
+                        await user_posts_file.write((',\n' if posts_count else '[\n') + post_json)
+                        posts_count += 1
+
+                await user_posts_file.write('\n]' if posts_count else '[]')
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        os.replace(temp_path, user_posts_path)
+
+    elapsed = max(time.monotonic() - started_at, 0.001)
+    logger.info(
+        f'Медиа {username}: {stats["files"]} файлов ({stats["deduplicated"]} дубликатов, {stats["cached"]} из кэша), {stats["bytes"] / 1024 / 1024:.1f} МБ за {elapsed:.1f} с, '
+        f'{stats["files"] / elapsed:.1f} файлов/с, {stats["bytes"] / 1024 / 1024 / elapsed:.2f} МБ/с'
+    )
 
-                        content_type = response.headers.get('Content-Type')
-                        extension = content_type.split('/')[-1] if content_type else 'jpg'
+    return user_posts_path
 
-                        image_path = os.path.join(post_directory, f'image_{index}.{extension}')
-                        picture['path'] = image_path
 
-                        with open(image_path, 'wb') as file:
-                            file.write(await response.content.read())
+async def unload_user_posts(domain: str, username: str, pages: AsyncIterable[list]):
+    users_data = []
+    async for user_posts in pages:
+        for post_data in user_posts:
+            date_now = datetime.now(pytz.timezone('Europe/Moscow'))
 
+            if domain == 'tenchat.ru':
+                date_published = datetime.fromisoformat(post_data['publishDate'])
+                users_data.append({
+                    'ID': post_data['id'],
+                    'URL': f'https://tenchat.ru/media/{post_data['titleTransliteration']}',
+                    'Название статьи': post_data['title'],
+                    'Просмотры': post_data['viewCount'],
+                    'Добавлено': date_published.strftime('%Y-%m-%d %H:%M:%S'),
+                    'Автор': f"{post_data['user']['name'] or ''} {post_data['user']['surname'] or ''}".strip(),
+                    'Парсинг': date_now.strftime('%Y-%m-%d %H:%M:%S')
+                })
             else:
-                for block in post_data['blocks']:
-                    if block['type'] == 'media':
-                        for item in block['data']['items']:
-                            image_data = item['image']['data']
-                            url = f'https://leonardo.osnova.io/{image_data['uuid']}'
+                date_published = datetime.fromtimestamp(post_data['date'], pytz.timezone('Europe/Moscow'))
+                users_data.append({
+                    'ID': post_data.get('id'),
+                    'URL': post_data.get('url'),
+                    'Название статьи': post_data['title'],
+                    'Просмотры': post_data['counters']['hits'],
+                    'Добавлено': date_published.strftime('%Y-%m-%d %H:%M:%S'),
+                    'Автор': post_data['author']['name'],
+                    'Парсинг': date_now.strftime('%Y-%m-%d %H:%M:%S')
+                })
 
-                            async with session.get(url) as response:
-                                if not response.ok:
-                                    continue
+    await sheets.update_user_data(
+        title=f'{domain.split('.')[0][:3]}-{username}',
+        users_data=users_data
+    )
 
-                                content_type = response.headers.get('Content-Type')
-                                extension = content_type.split('/')[-1] if content_type else image_data['type']
 
-                                image_path = os.path.join(post_directory, f'{image_data['uuid']}.{extension}')
-                                image_data['path'] = image_path
+async def load_user_posts(domain: str, username: str):
+    return await sheets.get_user_data(f'{domain.split('.')[0][:3]}-{username}')
 
-                                with open(image_path, 'wb') as file:
-                                    file.write(await response.content.read())
 
-            post_json_path = os.path.join(post_directory, 'data.json')
-            with open(post_json_path, 'w+') as post_file:
-                json.dump(clean_json_links(post_data), post_file, ensure_ascii=False, indent=4)
+def extract_known_posts(domain: str, user_posts: list[dict]) -> list[KnownPost]:
+    known_posts = []
+    for post_data in user_posts:
+        if domain == 'tenchat.ru':
+            known_posts.append(KnownPost(
+                post_id=post_data['id'],
+                post_url=f'https://tenchat.ru/media/{post_data["titleTransliteration"]}',
+                post_title=post_data['title'],
+                views=post_data['viewCount'],
+                publish_date=datetime.fromisoformat(post_data['publishDate']).replace(tzinfo=None)
+            ))
+        else:
+            known_posts.append(KnownPost(
+                post_id=post_data['id'],
+                post_url=post_data['url'],
+                post_title=post_data['title'],
+                views=post_data['counters']['hits'],
+                publish_date=datetime.fromtimestamp(post_data['date'], pytz.timezone('Europe/Moscow')).replace(tzinfo=None)
+            ))
 
-    user_posts_path = os.path.join(user_directory, 'posts.json')
-    with open(user_posts_path, 'w+') as user_posts_file:
-        json.dump(clean_json_links(user_posts), user_posts_file, ensure_ascii=False, indent=4)
+    return known_posts
 
-    return user_posts_path
 
+async def load_known_posts(domain: str, username: str) -> list[KnownPost]:
+    known_posts = storage.get_known_posts(domain, username)
+    if known_posts is not None:
+        return known_posts
 
-async def unload_user_posts(domain: str, username: str, user_posts: list):
-    users_data = []
-    for post_data in user_posts:
-        date_now = datetime.now(pytz.timezone('Europe/Moscow'))
+    logger.info(f'Индекс постов {username} пуст, загружаем посты из Google таблицы')
+    known_posts = [KnownPost.model_validate(post) for post in await load_user_posts(domain, username)]
+    storage.set_known_posts(domain, username, known_posts)
+    return known_posts
 
-        if domain == 'tenchat.ru':
-            date_published = datetime.fromisoformat(post_data['publishDate'])
-            users_data.append({
-                'ID': post_data['id'],
-                'URL': f'https://tenchat.ru/media/{post_data['titleTransliteration']}',
-                'Название статьи': post_data['title'],
-                'Просмотры': post_data['viewCount'],
-                'Добавлено': date_published.strftime('%Y-%m-%d %H:%M:%S'),
-                'Автор': f"{post_data['user']['name'] or ''} {post_data['user']['surname'] or ''}".strip(),
-                'Парсинг': date_now.strftime('%Y-%m-%d %H:%M:%S')
-            })
-        else:
-            date_published = datetime.fromtimestamp(post_data['date'], pytz.timezone('Europe/Moscow'))
-            users_data.append({
-                'ID': post_data.get('id'),
-                'URL': post_data.get('url'),
-                'Название статьи': post_data['title'],
-                'Просмотры': post_data['counters']['hits'],
-                'Добавлено': date_published.strftime('%Y-%m-%d %H:%M:%S'),
-                'Автор': post_data['author']['name'],
-                'Парсинг': date_now.strftime('%Y-%m-%d %H:%M:%S')
-            })
 
-    await sheets.update_user_data(
-        title=f'{domain.split('.')[0][:3]}-{username}',
-        users_data=users_data
-    )
+async def collect_known_posts(domain: str, pages: AsyncIterable[list]) -> list[KnownPost]:
+    return [known_post async for user_posts in pages for known_post in extract_known_posts(domain, user_posts)]
 
 
-async def load_user_posts(domain: str, username: str):
-    return await sheets.get_user_data(f'{domain.split('.')[0][:3]}-{username}')
+def save_known_posts(domain: str, username: str, known_posts: list[KnownPost]):
+    storage.set_known_posts(domain, username, known_posts)
 
 
-def extract_user_data(domain: str, username: str, user_posts: list[dict]) -> dict:
-    name = user_posts[0]['author']['name']
+async def extract_user_data(domain: str, username: str, pages: AsyncIterable[list]) -> dict:
+    name = ''
 
     today_posts = 0
     today_views = 0
     total_posts = 0
     total_views = 0
 
-    for post in user_posts:
-        post_date = datetime.fromtimestamp(post['date']).date()
-        views = post['counters']['hits']
-        total_posts += 1
-        total_views += views
+    async for user_posts in pages:
+        for post in user_posts:
+            if not total_posts:
+                name = post['author']['name']
 
-        if post_date == date.today():
-            today_posts += 1
-            today_views += views
+            post_date = datetime.fromtimestamp(post['date']).date()
+            views = post['counters']['hits']
+            total_posts += 1
+            total_views += views
+
+            if post_date == date.today():
+                today_posts += 1
+                today_views += views
 
     return {
         'url': f'https://{domain}/{username}',
@@ -211,25 +338,29 @@ def extract_user_data(domain: str, username: str, user_posts: list[dict]) -> dic
     }
 
 
-def extract_tenchat_user_data(username: str, user_posts: list[dict]) -> dict:
-    user = user_posts[0]['user']
-    name = user.get('name', '')
-    surname = user.get('surname', '')
+async def extract_tenchat_user_data(username: str, pages: AsyncIterable[list]) -> dict:
+    name = ''
+    surname = ''
 
     today_posts = 0
     today_views = 0
     total_posts = 0
     total_views = 0
 
-    for post in user_posts:
-        publish_date = datetime.fromisoformat(post['publishDate'].rstrip('Z')).date()
-        views = post['viewCount']
-        total_posts += 1
-        total_views += views
+    async for user_posts in pages:
+        for post in user_posts:
+            if not total_posts:
+                name = post['user'].get('name', '')
+                surname = post['user'].get('surname', '')
+
+            publish_date = datetime.fromisoformat(post['publishDate'].rstrip('Z')).date()
+            views = post['viewCount']
+            total_posts += 1
+            total_views += views
 
-        if publish_date == date.today():
-            today_posts += 1
-            today_views += views
+            if publish_date == date.today():
+                today_posts += 1
+                today_views += views
 
     return {
         'url': f'https://tenchat.ru/{username}',
@@ -240,3 +371,33 @@ def extract_tenchat_user_data(username: str, user_posts: list[dict]) -> dict:
         'total_posts': total_posts,
         'total_views': total_views,
     }
+
+
+async def iterate_pages(user_posts: list, page_size: int = 50) -> AsyncIterator[list]:
+    for index in range(0, len(user_posts), page_size):
+        yield user_posts[index:index + page_size]
+
+
+async def broadcast_pages(pages: AsyncIterable[list], consumers: dict) -> dict:
+    queues = {name: asyncio.Queue(maxsize=PAGES_QUEUE_SIZE) for name in consumers}
+
+    async def consume(queue: asyncio.Queue) -> AsyncIterator[list]:
+        while (user_posts := await queue.get()) is not None:
+            yield user_posts
+
+    async def produce():
+        async for user_posts in pages:
+            for queue in queues.values():
+                await queue.put(user_posts)
+
+        for queue in queues.values():
+            await queue.put(None)
+
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            task_group.create_task(produce())
+            tasks = {name: task_group.create_task(consumer(consume(queues[name]))) for name, consumer in consumers.items()}
+    except ExceptionGroup as error:
+        raise error.exceptions[0]
+
+    return {name: task.result() for name, task in tasks.items()}